@@ -0,0 +1,269 @@
+import asyncio
+import errno
+import select
+import socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from metrics import measure
+from portstates import FILTERED, OPEN, connect_state
+from ratecontrol import CongestionWindow
+from scheduler import HostState, Scheduler
+from targets import address_family
+from timing import ANSWERED, kernel_rtt, wait_for
+
+# Number of connects kept in flight at once. Each one holds a file descriptor,
+# so the window is capped below the process fd limit.
+DEFAULT_CONCURRENCY = 1000
+FD_RESERVE = 64
+# Threads running service probes on open ports
+DEFAULT_PROBE_CONCURRENCY = 32
+IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+LAG_INTERVAL = 0.01
+LAG_RATIO = 4
+
+def default_concurrency():
+    try:
+        import resource
+        soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ImportError, ValueError, OSError):
+        return DEFAULT_CONCURRENCY
+    if soft == resource.RLIM_INFINITY:
+        return DEFAULT_CONCURRENCY
+    return max(1, min(DEFAULT_CONCURRENCY, soft - FD_RESERVE))
+
+# How late the event loop runs its callbacks, measured every LAG_INTERVAL
+# seconds. A connect completion is only seen once the loop gets to it, so
+# while the loop lags its RTT samples are inflated by as much.
+class LoopLag:
+    def __init__(self, loop):
+        self.loop = loop
+        self.current = 0.0
+        self.handle = None
+        self.tick(loop.time())
+
+    def tick(self, due):
+        self.current = max(0.0, self.loop.time() - due)
+        due = self.loop.time() + LAG_INTERVAL
+        self.handle = self.loop.call_at(due, self.tick, due)
+
+    def close(self):
+        self.handle.cancel()
+
+    # A sample is kept when the lag is small next to it
+    def trusted(self, rtt):
+        return rtt > LAG_RATIO * self.current
+
+# Whether the connect in progress on `s` has completed, looked at directly
+# rather than through the loop. poll, unlike select, takes any descriptor.
+def connect_done(s):
+    poller = select.poll()
+    poller.register(s, select.POLLOUT)
+    return bool(poller.poll(0))
+
+# Waits until non-blocking socket `s`, whose connect is in progress, is
+# writable or `deadline` (time.monotonic()) has passed. Returns when the
+# connect completed, or None if it did not. A connect completed by the time
+# the timer fires counts even if the loop has not got to it yet.
+async def wait_connected(loop, s, deadline):
+    completed = loop.create_future()
+
+    def writable():
+        if not completed.done():
+            completed.set_result(time.monotonic())
+
+    def expired():
+        ready = False
+        try:
+            ready = not completed.done() and connect_done(s)
+        finally:
+            if not completed.done():
+                completed.set_result(time.monotonic() if ready else None)
+
+    loop.add_writer(s.fileno(), writable)
+    timer = loop.call_later(max(0, deadline - time.monotonic()), expired)
+    try:
+        return await completed
+    finally:
+        timer.cancel()
+        loop.remove_writer(s.fileno())
+
+# Connect to `port` of `host` (a scheduler.HostState whose window slot has
+# already been taken). Returns the connected socket, or None if the port did
+# not accept. The connect is issued here and its timeout runs from then on, so
+# the time a task waits for the loop is not taken out of it. Answered connects
+# (accepted or refused) feed the host's RTT estimate: the kernel's handshake
+# RTT of an open port, or the time it took unless `lag` (a LoopLag) says the
+# loop was too late to time it. The outcome is reported back to its
+# congestion window and to the optional metrics.ScanMetrics `metrics`. Closed
+# and filtered ports are reported to host.completed() here, open ones once
+# they have been probed.
+async def connect_port(loop, host, port, metrics=None, lag=None):
+    s = socket.socket(address_family(host.ip), socket.SOCK_STREAM)
+    s.setblocking(False)
+    answered = False
+    state = FILTERED
+    outcome = None
+    if metrics is not None:
+        metrics.started('connect')
+    st = time.monotonic()
+    try:
+        err = s.connect_ex((host.ip, port))
+        finished = time.monotonic()
+        if err in IN_PROGRESS:
+            finished = await wait_connected(loop, s, st + host.timing.connect_timeout())
+            err = None if finished is None else s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err is None:
+            outcome = 'timeout'
+        elif err in ANSWERED:
+            answered = True
+            state = connect_state(err)
+            outcome = 'open' if state == OPEN else 'refused'
+            rtt = kernel_rtt(s) if state == OPEN else None
+            if rtt is None and (lag is None or lag.trusted(finished - st)):
+                rtt = finished - st
+            if rtt is not None:
+                host.timing.update(rtt)
+            if state == OPEN:
+                return s
+        else:
+            # ICMP unreachable and friends: the network answered, the port is
+            # filtered
+            answered = True
+            outcome = 'error'
+    except BaseException:
+        s.close()
+        raise
+    finally:
+        if answered:
+            host.window.answered(st)
+        else:
+            host.window.timed_out(st)
+        if metrics is not None:
+            metrics.finished('connect', time.monotonic() - st, outcome)
+    s.close()
+    host.completed(port, state)
+    return None
+
+def probe_and_close(probe, s, ip, port, timeout, metrics=None):
+    with s:
+        return measure(metrics, 'probe', probe, s, ip, port, timeout)
+
+# Two-stage pipeline over the (host, port) work of `scheduler` (a
+# scheduler.Scheduler). Discovery keeps up to `concurrency` connects in flight
+# across all hosts, each host paced by its own congestion window and all of
+# them by the optional global ratecontrol.RateLimiter `limiter`. The connected
+# socket of every open port goes into a bounded queue; a separate pool of
+# `probe_concurrency` threads takes them off the queue and calls
+# `probe(sock, ip, port, timeout)` with the host's read timeout, so slow
+# banners never hold a discovery slot. Yields (ip, result) for every probe
+# result that is not None, as soon as it is ready. The socket is closed once
+# the probe returns. When the scheduler's deadline expires the probes still in
+# flight are waited for until its grace period ends, then abandoned. Both
+# stages are reported to the optional metrics.ScanMetrics `metrics`.
+async def scan_hosts(scheduler, probe, concurrency=DEFAULT_CONCURRENCY,
+                     probe_concurrency=DEFAULT_PROBE_CONCURRENCY, queue_size=None,
+                     limiter=None, metrics=None):
+    loop = asyncio.get_running_loop()
+    probe_concurrency = max(1, probe_concurrency)
+    found = asyncio.Queue(maxsize=queue_size or 2 * probe_concurrency)
+    results = asyncio.Queue()
+    executor = ThreadPoolExecutor(max_workers=probe_concurrency)
+    idle_workers = deque()
+    lag = LoopLag(loop)
+    done = object()
+
+    def wake():
+        while idle_workers:
+            waiter = idle_workers.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def idle(delay):
+        waiter = loop.create_future()
+        idle_workers.append(waiter)
+        try:
+            await wait_for(waiter, delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def discover():
+        try:
+            while True:
+                item = scheduler.next_probe()
+                if item is None:
+                    return
+                host, port = item
+                if host is None:
+                    await idle(port)
+                    continue
+                if limiter is not None:
+                    await limiter.acquire()
+                s = await connect_port(loop, host, port, metrics, lag)
+                wake()
+                if s is not None:
+                    await found.put((host, port, s))
+        finally:
+            wake()
+
+    async def discovery():
+        try:
+            await asyncio.gather(*[discover() for _ in range(max(1, concurrency))])
+            await found.join()
+        except Exception as e:
+            await results.put(e)
+        await results.put(done)
+
+    async def prober():
+        while True:
+            host, port, s = await found.get()
+            try:
+                result = await loop.run_in_executor(executor, probe_and_close, probe, s, host.ip,
+                                                    port, host.timing.read_timeout(), metrics)
+                host.completed(port, OPEN, result)
+            except Exception as e:
+                result = e
+            finally:
+                found.task_done()
+            if result is not None:
+                await results.put(result if isinstance(result, Exception) else (host.ip, result))
+
+    tasks = [asyncio.create_task(discovery())]
+    tasks += [asyncio.create_task(prober()) for _ in range(probe_concurrency)]
+    deadline = scheduler.deadline
+    try:
+        while True:
+            if deadline is None:
+                result = await results.get()
+            else:
+                try:
+                    result = await wait_for(results.get(), deadline.abort_in())
+                except asyncio.TimeoutError:
+                    deadline.partial = True
+                    break
+            if result is done:
+                break
+            if isinstance(result, Exception):
+                raise result
+            yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        while not found.empty():
+            found.get_nowait()[2].close()
+        executor.shutdown(wait=False)
+        lag.close()
+
+# Single-host form of scan_hosts: yields probe results for `ports` on `ip`,
+# paced by `timing` (a timing.HostTiming) and `window` (a
+# ratecontrol.CongestionWindow, by default capped at `concurrency`).
+async def scan_ports(ip, ports, probe, concurrency=DEFAULT_CONCURRENCY, timing=None,
+                     probe_concurrency=DEFAULT_PROBE_CONCURRENCY, queue_size=None,
+                     window=None, limiter=None):
+    host = HostState(ip, ports, timing, window or CongestionWindow(maximum=concurrency))
+    scheduler = Scheduler([ip], ports, lambda ip, ports: host)
+    async for _, result in scan_hosts(scheduler, probe, concurrency, probe_concurrency,
+                                      queue_size, limiter):
+        yield result
@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import selectors
+import socket
+import threading
+import time
+import psutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import async_scan
+import epoll_scan
+from timing import HostTiming
+
+# Connects/sec benchmark of the scan engines against a farm of loopback
+# listeners. Every `open_every`-th port of the scanned range gets a listener,
+# the rest answer with RST. Keep the range below the kernel's ephemeral port
+# range, otherwise a connect can land on its own source port and self-connect.
+
+class ListenerFarm:
+    def __init__(self, first_port, count, open_every):
+        self.listeners = []
+        for port in range(first_port, first_port + count, open_every):
+            l = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            l.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                l.bind(('127.0.0.1', port))
+            except OSError:
+                l.close()
+                continue
+            l.listen(128)
+            l.setblocking(False)
+            self.listeners.append(l)
+        self.open_ports = {l.getsockname()[1] for l in self.listeners}
+        self.running = True
+        self.thread = threading.Thread(target=self.accept_loop, daemon=True)
+
+    def accept_loop(self):
+        sel = selectors.DefaultSelector()
+        for l in self.listeners:
+            sel.register(l, selectors.EVENT_READ)
+        while self.running:
+            for key, _ in sel.select(0.1):
+                try:
+                    conn, _ = key.fileobj.accept()
+                    conn.close()
+                except OSError:
+                    pass
+        sel.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+        for l in self.listeners:
+            l.close()
+
+def thread_pool_open(ip, port, timeout):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        if s.connect_ex((ip, port)) == 0:
+            return port
+
+def run_thread_pool(ip, ports, concurrency, timeout):
+    found = set()
+    with ThreadPoolExecutor(max_workers=psutil.cpu_count(logical=True)) as executor:
+        futures = [executor.submit(thread_pool_open, ip, port, timeout) for port in ports]
+        for future in as_completed(futures):
+            if future.result():
+                found.add(future.result())
+    return found
+
+def run_async(ip, ports, concurrency, timeout):
+    async def scan():
+        return {port async for port in async_scan.scan_ports(
+            ip, ports, lambda s, ip, port, timeout: port, concurrency=concurrency,
+            timing=HostTiming(connect_timeout=timeout))}
+    return asyncio.run(scan())
+
+def run_epoll(ip, ports, concurrency, timeout, recycle=True):
+    found = set()
+    timing = HostTiming(connect_timeout=timeout)
+    for port, s in epoll_scan.open_ports(ip, ports, concurrency, timing, recycle):
+        s.close()
+        found.add(port)
+    return found
+
+def run_epoll_no_recycle(ip, ports, concurrency, timeout):
+    return run_epoll(ip, ports, concurrency, timeout, recycle=False)
+
+ENGINES = {
+    "thread": run_thread_pool,
+    "async": run_async,
+    "epoll": run_epoll,
+    "epoll-no-recycle": run_epoll_no_recycle,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="connects/sec benchmark of the scan engines")
+    parser.add_argument("--first-port", type=int, default=20000)
+    parser.add_argument("--ports", type=int, default=10000, help="number of ports scanned")
+    parser.add_argument("--open-every", type=int, default=100, help="one listener per N ports")
+    parser.add_argument("--concurrency", type=int, default=async_scan.default_concurrency())
+    parser.add_argument("--timeout", type=float, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=list(ENGINES))
+    args = parser.parse_args()
+
+    ip = '127.0.0.1'
+    ports = range(args.first_port, args.first_port + args.ports)
+    with ListenerFarm(args.first_port, args.ports, args.open_every) as farm:
+        print(f"{len(ports)} ports, {len(farm.open_ports)} listeners, concurrency {args.concurrency}")
+        print(f"{'ENGINE':<18}{'BEST s':>10}{'CONNECTS/s':>14}{'OPEN':>8}")
+        for name in args.engines:
+            best = None
+            for _ in range(args.repeat):
+                st = time.perf_counter()
+                found = ENGINES[name](ip, ports, args.concurrency, args.timeout)
+                duration = time.perf_counter() - st
+                best = duration if best is None else min(best, duration)
+            status = "" if found == farm.open_ports else "  MISMATCH"
+            print(f"{name:<18}{best:>10.3f}{len(ports) / best:>14.0f}{len(found):>8}{status}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+import argparse
+import asyncio
+import errno
+import json
+import os
+import re
+import shutil
+import signal
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# End-to-end benchmark of the scanners in this repo against a loopback
+# target farm.
+#
+# The farm listens on one loopback address (127.0.0.2 by default, so services
+# bound to 0.0.0.0 stay out of the way) with a known mix of ports:
+#   open      accepts and closes
+#   silent    accepts and never sends anything
+#   slow      sends an SSH banner after SLOW_DELAY seconds
+#   ssh       sends an SSH banner at once
+#   http      answers a request like nginx
+#   tls       the same behind TLS, with a throwaway self-signed certificate
+#   rtsp      answers like a GStreamer RTSP server
+#   filtered  a listener whose accept queue is kept full, so SYNs are dropped
+#             and connects time out as they would against a firewall
+# and every other port of a block starting at --first-port refuses. Ports
+# still held by an earlier run (TIME_WAIT) or another program are skipped.
+#
+# Each scanner runs as a subprocess over ports 1-10000, the range the C++
+# scanners and genuinefinal22.py hard-code: the Python engines of
+# thread_scan.py, genuinefinal22.py, the C++ scanners of nmapVsScript (built
+# from source with g++) and nmap when installed. Recorded per scanner: wall
+# time, connects/s over the range, peak RSS, and accuracy over the farm's
+# ports: expected open ports found, ports wrongly reported open, and services
+# named right. With --baseline the run is compared to a saved one and the
+# exit status is 1 if any scanner got slower, bigger or less accurate.
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+LEGACY = os.path.join(ROOT, 'nmapVsScript')
+SCAN_RANGE = (1, 10000)
+SLOW_DELAY = 0.3
+SSH_BANNER = b"SSH-2.0-OpenSSH_9.6p1 Ubuntu-3ubuntu13\r\n"
+HTTP_RESPONSE = b"HTTP/1.1 200 OK\r\nServer: nginx/1.24.0\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+RTSP_RESPONSE = (b"RTSP/1.0 200 OK\r\nCSeq: 1\r\nServer: GStreamer RTSP server\r\n"
+                 b"Public: OPTIONS, DESCRIBE, SETUP, PLAY, TEARDOWN\r\n\r\n")
+
+# role, number of ports, ports tried first (where service probes expect it)
+LAYOUT = [
+    ('open', 20, ()),
+    ('silent', 5, ()),
+    ('slow', 5, ()),
+    ('ssh', 3, (2222, 22)),
+    ('http', 3, (8080, 8000, 8008)),
+    ('tls', 2, (8443, 9443, 4443)),
+    ('rtsp', 1, (8554, 554)),
+    ('filtered', 5, ()),
+]
+# service each scanner should name, and the spellings accepted for it
+SERVICES = {'ssh': 'ssh', 'slow': 'ssh', 'http': 'http', 'tls': 'https', 'rtsp': 'rtsp'}
+ALIASES = {'https': {'https', 'ssl/http', 'ssl|http'}}
+
+DEFAULT_TOLERANCE = 0.2
+
+def make_certificate(directory):
+    if shutil.which('openssl') is None:
+        return None
+    cert, key = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    done = subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '2',
+                           '-subj', '/CN=bench.local', '-keyout', key, '-out', cert],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if done.returncode != 0:
+        return None
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    return ctx
+
+def bind(ip, port, backlog=128):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind((ip, port))
+    except OSError:
+        s.close()
+        return None
+    s.listen(backlog)
+    return s
+
+def refused(ip, port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.settimeout(1)
+        return s.connect_ex((ip, port)) == errno.ECONNREFUSED
+
+async def read_request(reader):
+    try:
+        await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 2)
+        return True
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+            ConnectionError, ssl.SSLError):
+        return False
+
+async def drain_until_closed(reader):
+    try:
+        await asyncio.wait_for(reader.read(), 10)
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+
+def handler(role):
+    async def handle(reader, writer):
+        try:
+            if role == 'slow':
+                await asyncio.sleep(SLOW_DELAY)
+            if role in ('ssh', 'slow'):
+                writer.write(SSH_BANNER)
+                await writer.drain()
+            if role in ('http', 'tls', 'rtsp'):
+                if await read_request(reader):
+                    writer.write(RTSP_RESPONSE if role == 'rtsp' else HTTP_RESPONSE)
+                    await writer.drain()
+            elif role != 'open':
+                await drain_until_closed(reader)
+        except (ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+class TargetFarm:
+    def __init__(self, ip, first_port, block, tls_context):
+        self.ip = ip
+        self.roles = {}     # port -> role
+        self.sockets = {}   # port -> listening socket
+        self.fillers = []   # connections holding the filtered ports' queues full
+        self.tls_context = tls_context
+        ports = iter(range(first_port, first_port + block))
+        for role, count, preferred in LAYOUT:
+            if role == 'tls' and tls_context is None:
+                continue
+            candidates = [port for port in preferred if not first_port <= port < first_port + block]
+            for _ in range(count):
+                s = None
+                while s is None:
+                    port = candidates.pop(0) if candidates else next(ports)
+                    s = bind(ip, port, 0 if role == 'filtered' else 128)
+                self.roles[port] = role
+                self.sockets[port] = s
+        # the rest of the block refuses, unless something else listens there
+        self.closed = {port for port in ports if refused(ip, port)}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def expected_open(self):
+        return {port for port, role in self.roles.items() if role != 'filtered'}
+
+    def judged_ports(self):
+        return set(self.roles) | self.closed
+
+    async def serve(self):
+        self.servers = []
+        for port, role in self.roles.items():
+            s = self.sockets[port]
+            if role == 'filtered':
+                filler = socket.create_connection((self.ip, port))
+                self.fillers.append(filler)
+                continue
+            ctx = self.tls_context if role == 'tls' else None
+            self.servers.append(await asyncio.start_server(handler(role), sock=s, ssl=ctx))
+
+    def __enter__(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.serve(), self.loop).result()
+        return self
+
+    def __exit__(self, *exc):
+        async def stop():
+            for server in self.servers:
+                server.close()
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        for s in list(self.sockets.values()) + self.fillers:
+            s.close()
+
+# Runs `command` and returns (wall seconds, peak RSS bytes, output, exit status)
+def run_command(command, cwd, timeout):
+    with tempfile.TemporaryFile() as out:
+        st = time.perf_counter()
+        process = subprocess.Popen(command, cwd=cwd, stdout=out, stderr=subprocess.STDOUT)
+        timer = threading.Timer(timeout, process.send_signal, (signal.SIGKILL,))
+        timer.start()
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+        finally:
+            timer.cancel()
+        wall = time.perf_counter() - st
+        process.returncode = os.waitstatus_to_exitcode(status)
+        out.seek(0)
+        text = out.read().decode(errors='replace')
+    return wall, usage.ru_maxrss * 1024, text, process.returncode
+
+TEXT_PORT = re.compile(r"^(\d+)/tcp\s+open\s*(\S*)", re.M)
+GREPABLE_PORT = re.compile(r"(\d+)/open/tcp//([^/]*)/")
+
+# {port: service} from "22/tcp   open  ssh ..." lines
+def parse_text(text, output_file):
+    return {int(port): service for port, service in TEXT_PORT.findall(text)}
+
+def parse_grepable(text, output_file):
+    return {int(port): service for port, service in GREPABLE_PORT.findall(text)}
+
+def parse_json_lines(text, output_file):
+    found = {}
+    with open(output_file) as f:
+        for line in f:
+            record = json.loads(line)
+            if record['proto'] == 'tcp':
+                found[record['port']] = record['service']
+    return found
+
+def build_cpp(source, directory):
+    if shutil.which('g++') is None:
+        return None
+    binary = os.path.join(directory, os.path.splitext(os.path.basename(source))[0])
+    done = subprocess.run(['g++', '-O2', '-pthread', '-o', binary, source],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return binary if done.returncode == 0 else None
+
+# name -> (command, cwd, parser, names services) for every scanner available
+def scanners(ip, directory):
+    first, last = SCAN_RANGE
+    found = {}
+    for engine in ('async', 'epoll', 'thread'):
+        output_file = os.path.join(directory, f'{engine}.jsonl')
+        found[f'py-{engine}'] = ([sys.executable, 'thread_scan.py', ip, '-Pn', '-p', f'{first}-{last}',
+                                  '--engine', engine, '-oJ', output_file],
+                                 ROOT, parse_json_lines, output_file, True)
+    if (os.cpu_count() or 1) > 1:
+        output_file = os.path.join(directory, 'sharded.jsonl')
+        found['py-async-sharded'] = ([sys.executable, 'thread_scan.py', ip, '-Pn', '-p', f'{first}-{last}',
+                                      '--processes', '0', '-oJ', output_file],
+                                     ROOT, parse_json_lines, output_file, True)
+    found['genuinefinal22'] = ([sys.executable, 'genuinefinal22.py', ip], LEGACY, parse_text, None, True)
+    for source, names in (('scan_port.cpp', True), ('scan_port_pool.cpp', False)):
+        binary = build_cpp(os.path.join(LEGACY, source), directory)
+        if binary is not None:
+            found[f'cpp-{os.path.splitext(source)[0]}'] = ([binary, ip], LEGACY, parse_text, None, names)
+    if shutil.which('nmap'):
+        found['nmap'] = (['nmap', '-Pn', '-sT', '-sV', '-p', f'{first}-{last}', '-oG', '-', ip],
+                         ROOT, parse_grepable, None, True)
+    return found
+
+def service_matches(expected, found):
+    return found in ALIASES.get(expected, {expected})
+
+def measure(farm, name, scanner, timeout):
+    command, cwd, parse, output_file, names = scanner
+    wall, rss, text, status = run_command(command, cwd, timeout)
+    try:
+        found = parse(text, output_file)
+    except (OSError, ValueError, KeyError):
+        found = {}
+    judged = farm.judged_ports()
+    expected = farm.expected_open()
+    reported = {port for port in found if port in judged}
+    with_service = [port for port in expected if farm.roles[port] in SERVICES]
+    record = {
+        'scanner': name,
+        'exit': status,
+        'wall': round(wall, 3),
+        'connects_per_s': round((SCAN_RANGE[1] - SCAN_RANGE[0] + 1) / wall),
+        'peak_rss_mb': round(rss / 2**20, 1),
+        'found': len(reported & expected),
+        'expected': len(expected),
+        'false_open': len(reported - expected),
+        'services_ok': None,
+        'services_total': len(with_service),
+    }
+    if names:
+        record['services_ok'] = sum(1 for port in with_service
+                                    if port in found and service_matches(SERVICES[farm.roles[port]], found[port]))
+    return record
+
+# Regressions of `current` against `baseline` (both {scanner: record})
+def regressions(current, baseline, tolerance):
+    problems = []
+    for name, record in current.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if record['wall'] > base['wall'] * (1 + tolerance):
+            problems.append(f"{name}: wall time {record['wall']:.3f}s vs {base['wall']:.3f}s")
+        if record['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            problems.append(f"{name}: peak RSS {record['peak_rss_mb']} MB vs {base['peak_rss_mb']} MB")
+        if record['found'] < base['found']:
+            problems.append(f"{name}: found {record['found']} open ports vs {base['found']}")
+        if record['false_open'] > base['false_open']:
+            problems.append(f"{name}: {record['false_open']} false open ports vs {base['false_open']}")
+        if (record['services_ok'] or 0) < (base['services_ok'] or 0):
+            problems.append(f"{name}: {record['services_ok']} services named vs {base['services_ok']}")
+    return problems
+
+def print_table(records):
+    print(f"{'SCANNER':<20}{'WALL s':>9}{'CONNECTS/s':>12}{'RSS MB':>8}{'OPEN':>9}{'FALSE':>7}{'SERVICES':>10}")
+    for r in records:
+        services = '-' if r['services_ok'] is None else f"{r['services_ok']}/{r['services_total']}"
+        status = "" if r['exit'] == 0 else f"  exit {r['exit']}"
+        print(f"{r['scanner']:<20}{r['wall']:>9.2f}{r['connects_per_s']:>12}{r['peak_rss_mb']:>8}"
+              f"{r['found']:>5}/{r['expected']:<3}{r['false_open']:>7}{services:>10}{status}")
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of the scanners against a loopback target farm")
+    parser.add_argument("--ip", default="127.0.0.2", help="loopback address the farm listens on")
+    parser.add_argument("--first-port", type=int, default=7000, help="first port of the farm's block")
+    parser.add_argument("--block", type=int, default=200, help="ports in the farm's block")
+    parser.add_argument("--scanners", nargs="+", help="scanners to run (default: every one available)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per scanner; the fastest is kept")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before a scanner is killed")
+    parser.add_argument("--json", metavar="FILE", help="write the results to FILE")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="results saved with --json to compare against; regressions exit with 1")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed growth of wall time and peak RSS over the baseline "
+                             f"(default: {DEFAULT_TOLERANCE:g})")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        available = scanners(args.ip, directory)
+        names = args.scanners or list(available)
+        missing = [name for name in names if name not in available]
+        if missing:
+            parser.error(f"not available: {', '.join(missing)} (have: {', '.join(available)})")
+        with TargetFarm(args.ip, args.first_port, args.block, make_certificate(directory)) as farm:
+            roles = {}
+            for role in farm.roles.values():
+                roles[role] = roles.get(role, 0) + 1
+            print(f"farm on {args.ip}: " + ", ".join(f"{n} {role}" for role, n in roles.items())
+                  + f", {len(farm.closed)} closed")
+            records = []
+            for name in names:
+                runs = [measure(farm, name, available[name], args.timeout) for _ in range(args.repeat)]
+                records.append(min(runs, key=lambda r: r['wall']))
+    print_table(records)
+
+    results = {r['scanner']: r for r in records}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'time': time.time(), 'results': results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        problems = regressions(results, baseline, args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import base64
+import json
+import os
+import threading
+import time
+import zlib
+from portstates import UNKNOWN, PortStates
+from results import PortResult
+
+# On-disk scan state for --checkpoint / --resume.
+#
+# The file holds the targets and the port list of the scan, and for every
+# host that has been started its packed port states (see portstates) plus the
+# open ports found on it. State arrays are zlib compressed, so a checkpoint
+# of a large sweep stays small. A port gets a state only once its outcome is
+# final (closed, filtered, or open and probed), so resuming redoes exactly
+# the work in flight when the scan stopped. The file is rewritten atomically
+# every `interval` seconds.
+
+VERSION = 2
+DEFAULT_INTERVAL = 10.0
+
+# [[first, last], ...] runs of consecutive ports, in scan order
+def port_ranges(ports):
+    ranges = []
+    for port in ports:
+        if ranges and ranges[-1][1] == port - 1:
+            ranges[-1][1] = port
+        else:
+            ranges.append([port, port])
+    return ranges
+
+def expand_ranges(ranges):
+    return [port for first, last in ranges for port in range(first, last + 1)]
+
+def encode_states(packed):
+    return base64.b64encode(zlib.compress(packed)).decode()
+
+def decode_states(text):
+    return zlib.decompress(base64.b64decode(text))
+
+class Checkpoint:
+    # `states` is the scan's portstates.PortStates, updated by the engines
+    def __init__(self, path, hosts, states, interval=DEFAULT_INTERVAL):
+        self.path = path
+        self.hosts = list(hosts)
+        self.states = states
+        self.ports = states.ports
+        self.interval = interval
+        self.results = {}  # ip -> [PortResult]
+        self.saved_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, interval=DEFAULT_INTERVAL):
+        with open(path) as f:
+            state = json.load(f)
+        if state.get('version') != VERSION:
+            raise ValueError(f"{path}: unsupported checkpoint version {state.get('version')}")
+        states = PortStates(expand_ranges(state['ports']))
+        checkpoint = cls(path, state['hosts'], states, interval)
+        for ip, progress in state['progress'].items():
+            states.merge(ip, decode_states(progress['states']))
+            checkpoint.results[ip] = [PortResult(*result) for result in progress['results']]
+        return checkpoint
+
+    def host_done(self, ip):
+        return self.states.count(ip, UNKNOWN) == 0
+
+    def ports_done(self):
+        return sum(len(self.ports) - self.states.count(ip, UNKNOWN) for ip in self.hosts)
+
+    # Ports of `ip` still to be scanned, in scan order or in the order of
+    # `ports` (a subset of the checkpoint's ports)
+    def remaining(self, ip, ports=None):
+        for port in self.ports if ports is None else ports:
+            if self.states.get(ip, port) == UNKNOWN:
+                yield port
+
+    # Called after a port's final state has been set; `result` is the probe
+    # result of an open port. Safe to call from any thread.
+    def record(self, ip, result=None):
+        with self.lock:
+            if result is not None:
+                self.results.setdefault(ip, []).append(result)
+            if time.monotonic() - self.saved_at >= self.interval:
+                self.write()
+
+    def save(self):
+        with self.lock:
+            self.write()
+
+    def write(self):
+        with self.states.lock:
+            packed = {ip: bytes(states) for ip, states in self.states.hosts.items()}
+        progress = {}
+        for ip, states in packed.items():
+            progress[ip] = {
+                'states': encode_states(states),
+                'results': [list(result) for result in self.results.get(ip, [])],
+            }
+        state = {'version': VERSION, 'hosts': self.hosts,
+                 'ports': port_ranges(self.ports), 'progress': progress}
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(state, f, separators=(',', ':'))
+            os.replace(tmp, self.path)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        self.saved_at = time.monotonic()
@@ -0,0 +1,156 @@
+import asyncio
+import os
+import socket
+import struct
+from targets import address_family
+
+# In-process host discovery. Each target gets TCP connect pings to a few
+# common ports plus an ICMP echo request when the process may open an ICMP
+# socket (unprivileged ping socket on Linux, or raw socket as root), ICMPv6
+# for IPv6 targets. A SYN/ACK, a RST or an echo reply proves the host is up,
+# so live hosts are known after about one RTT; only hosts that answer nothing
+# wait for the timeout. Hosts that drop ICMP are still found through the TCP
+# pings.
+
+DEFAULT_PING_PORTS = (80, 443, 22, 445)
+DEFAULT_CONCURRENCY = 200  # hosts probed at once
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP6_ECHO_REQUEST = 128
+ICMP6_ECHO_REPLY = 129
+
+async def tcp_ping(loop, ip, port, timeout):
+    s = socket.socket(address_family(ip), socket.SOCK_STREAM)
+    s.setblocking(False)
+    try:
+        await asyncio.wait_for(loop.sock_connect(s, (ip, port)), timeout)
+        return True
+    except ConnectionRefusedError:
+        return True
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        s.close()
+
+def checksum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+def open_icmp_socket(family=socket.AF_INET):
+    proto = socket.IPPROTO_ICMPV6 if family == socket.AF_INET6 else socket.IPPROTO_ICMP
+    for kind in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            s = socket.socket(family, kind, proto)
+        except (OSError, AttributeError):
+            continue
+        s.setblocking(False)
+        return s, kind == socket.SOCK_RAW
+    return None, False
+
+# One ICMP socket per address family shared by every target of a discovery
+# run. Replies are matched by source address and by a random token in the
+# echo payload. The kernel fills in ICMPv6 checksums itself.
+class IcmpPinger:
+    def __init__(self, loop, family=socket.AF_INET):
+        self.loop = loop
+        self.v6 = family == socket.AF_INET6
+        self.request = ICMP6_ECHO_REQUEST if self.v6 else ICMP_ECHO_REQUEST
+        self.reply = ICMP6_ECHO_REPLY if self.v6 else ICMP_ECHO_REPLY
+        self.sock, self.raw = open_icmp_socket(family)
+        self.token = os.urandom(8)
+        self.ident = os.getpid() & 0xffff
+        self.waiters = {}
+        if self.sock is not None:
+            loop.add_reader(self.sock.fileno(), self.on_readable)
+
+    def available(self):
+        return self.sock is not None
+
+    def packet(self, seq):
+        header = struct.pack("!BBHHH", self.request, 0, 0, self.ident, seq)
+        if self.v6:
+            return header + self.token
+        csum = checksum(header + self.token)
+        return struct.pack("!BBHHH", self.request, 0, csum, self.ident, seq) + self.token
+
+    def on_readable(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            if self.raw and not self.v6:
+                data = data[(data[0] & 0x0f) * 4:]
+            if len(data) >= 16 and data[0] == self.reply and data[8:16] == self.token:
+                waiter = self.waiters.get(address[0])
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(True)
+
+    async def ping(self, ip, timeout):
+        waiter = self.loop.create_future()
+        self.waiters[ip] = waiter
+        try:
+            self.sock.sendto(self.packet(len(self.waiters) & 0xffff), (ip, 0))
+            return await asyncio.wait_for(waiter, timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        finally:
+            if self.waiters.get(ip) is waiter:
+                del self.waiters[ip]
+
+    def close(self):
+        if self.sock is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+
+async def host_up(loop, ip, ports, timeout, pinger=None):
+    checks = [asyncio.ensure_future(tcp_ping(loop, ip, port, timeout)) for port in ports]
+    if pinger is not None and pinger.available():
+        checks.append(asyncio.ensure_future(pinger.ping(ip, timeout)))
+    try:
+        for check in asyncio.as_completed(checks):
+            if await check:
+                return True
+        return False
+    finally:
+        for check in checks:
+            check.cancel()
+
+# Returns the hosts of `hosts` that answered, in their original order.
+# `hosts` may be a lazy iterator: it is pulled as workers free up, and only
+# the live hosts are kept. on_down(ip) is called for each host that is not.
+async def discover_hosts(hosts, ports=DEFAULT_PING_PORTS, timeout=1, icmp=True,
+                         concurrency=DEFAULT_CONCURRENCY, on_down=None):
+    loop = asyncio.get_running_loop()
+    pingers = {}
+    up = []  # (position, ip)
+    work = enumerate(hosts)
+
+    def pinger_for(ip):
+        if not icmp:
+            return None
+        family = address_family(ip)
+        if family not in pingers:
+            pingers[family] = IcmpPinger(loop, family)
+        return pingers[family]
+
+    async def worker():
+        for i, ip in work:
+            if await host_up(loop, ip, ports, timeout, pinger_for(ip)):
+                up.append((i, ip))
+            elif on_down is not None:
+                on_down(ip)
+
+    try:
+        await asyncio.gather(*[worker() for _ in range(max(1, concurrency))])
+    finally:
+        for pinger in pingers.values():
+            pinger.close()
+    return [ip for i, ip in sorted(up)]
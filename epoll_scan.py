@@ -0,0 +1,240 @@
+import errno
+import queue
+import selectors
+import socket
+import heapq
+import itertools
+import threading
+import time
+from portstates import FILTERED, OPEN, connect_state
+from metrics import connect_outcome, measure
+from ratecontrol import CongestionWindow
+from scheduler import HostState, Scheduler
+from targets import address_family
+from timing import ANSWERED
+
+# Low level connect-scan core. Sockets are non-blocking, connect_ex returns
+# EINPROGRESS and completions are harvested in batches from the selector
+# (epoll on Linux). Sockets whose connect was refused are put back in a spare
+# pool and reused for the next port instead of being closed and re-created.
+DEFAULT_CONCURRENCY = 1000
+DEFAULT_PROBE_CONCURRENCY = 32
+
+IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY)
+
+def new_socket(family=socket.AF_INET):
+    s = socket.socket(family, socket.SOCK_STREAM)
+    s.setblocking(False)
+    return s
+
+def start_connect(s, ip, port):
+    err = s.connect_ex((ip, port))
+    if err == errno.ECONNABORTED:
+        # A recycled socket reports the abort of its previous attempt once
+        err = s.connect_ex((ip, port))
+    return err
+
+# Yield (host, port, sock) for every open port handed out by `scheduler` (a
+# scheduler.Scheduler), keeping up to `concurrency` connects in flight across
+# all hosts. The connected socket is handed over to the caller, which is
+# responsible for closing it. Each host's timing is fed every answered connect
+# and its congestion window the outcome of each attempt; `limiter` is an
+# optional global ratecontrol.RateLimiter, and every connect is reported to
+# the optional metrics.ScanMetrics `metrics`. Closed and filtered ports are
+# reported to host.completed(); for open ports that is left to the caller.
+def connect_scan(scheduler, concurrency=DEFAULT_CONCURRENCY, limiter=None, recycle=True,
+                 metrics=None):
+    sel = selectors.DefaultSelector()
+    pending = []  # heap of [deadline, seq, sock, port, start, host]
+    spare = {}  # address family -> sockets
+    inflight = 0
+    seq = itertools.count()
+    exhausted = False
+
+    def release(s, err):
+        pool = spare.setdefault(s.family, [])
+        if recycle and err == errno.ECONNREFUSED and len(pool) < concurrency:
+            pool.append(s)
+        else:
+            s.close()
+
+    def finished(start, outcome, now=None):
+        if metrics is not None:
+            metrics.finished('connect', (now or time.monotonic()) - start, outcome)
+
+    try:
+        while True:
+            throttled = 0
+            while not exhausted and inflight < concurrency:
+                if limiter is not None:
+                    throttled = limiter.try_acquire()
+                    if throttled:
+                        break
+                item = scheduler.next_probe()
+                if item is None:
+                    exhausted = True
+                    break
+                host, port = item
+                if host is None:
+                    throttled = port
+                    break
+                family = address_family(host.ip)
+                pool = spare.get(family)
+                s = pool.pop() if pool else new_socket(family)
+                start = time.monotonic()
+                if metrics is not None:
+                    metrics.started('connect')
+                err = start_connect(s, host.ip, port)
+                if err in IN_PROGRESS:
+                    attempt = [start + host.timing.connect_timeout(), next(seq), s, port, start, host]
+                    sel.register(s, selectors.EVENT_WRITE, attempt)
+                    heapq.heappush(pending, attempt)
+                    inflight += 1
+                else:
+                    host.window.answered(start)
+                    finished(start, connect_outcome(err))
+                    if err == 0:
+                        yield host, port, s
+                    else:
+                        release(s, err)
+                        host.completed(port, connect_state(err))
+            if not inflight:
+                if exhausted:
+                    break
+                time.sleep(throttled or 0)
+                continue
+
+            wait = max(0, pending[0][0] - time.monotonic())
+            if throttled:
+                wait = min(wait, throttled)
+            events = sel.select(wait)
+            now = time.monotonic()
+            for key, _ in events:
+                attempt = key.data
+                s = attempt[2]
+                host = attempt[5]
+                sel.unregister(s)
+                attempt[2] = None
+                inflight -= 1
+                err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err in ANSWERED:
+                    host.timing.update(now - attempt[4])
+                host.window.answered(attempt[4])
+                finished(attempt[4], connect_outcome(err), now)
+                if err == 0:
+                    yield host, attempt[3], s
+                else:
+                    release(s, err)
+                    host.completed(attempt[3], connect_state(err))
+
+            now = time.monotonic()
+            while pending and (pending[0][2] is None or pending[0][0] <= now):
+                attempt = heapq.heappop(pending)
+                s = attempt[2]
+                if s is not None:
+                    sel.unregister(s)
+                    s.close()
+                    inflight -= 1
+                    attempt[5].window.timed_out(attempt[4])
+                    finished(attempt[4], 'timeout', now)
+                    attempt[5].completed(attempt[3], FILTERED)
+    finally:
+        for attempt in pending:
+            if attempt[2] is not None:
+                attempt[2].close()
+                finished(attempt[4], None)
+        for pool in spare.values():
+            for s in pool:
+                s.close()
+        sel.close()
+
+def single_host(ip, ports, concurrency, timing, window):
+    host = HostState(ip, ports, timing, window or CongestionWindow(maximum=concurrency))
+    return Scheduler([ip], ports, lambda ip, ports: host)
+
+# Single-host form of connect_scan: yields (port, sock) for every open port of
+# `ports` on `ip`, paced by `timing` (a timing.HostTiming) and `window` (a
+# ratecontrol.CongestionWindow, by default capped at `concurrency`).
+def open_ports(ip, ports, concurrency=DEFAULT_CONCURRENCY, timing=None, recycle=True,
+               window=None, limiter=None):
+    scheduler = single_host(ip, ports, concurrency, timing, window)
+    for _, port, s in connect_scan(scheduler, concurrency, limiter, recycle):
+        yield port, s
+
+# Two-stage pipeline: connect_scan runs in a discovery thread and feeds a
+# bounded queue that `probe_concurrency` probe threads consume, calling
+# `probe(sock, ip, port, timeout)` on each open port with the host's read
+# timeout. Yields (ip, result) for every result that is not None as soon as
+# its probe returns. Past the scheduler's deadline and its grace period the
+# remaining probes are abandoned. Both stages are reported to the optional
+# metrics.ScanMetrics `metrics`.
+def scan_hosts(scheduler, probe, concurrency=DEFAULT_CONCURRENCY,
+               probe_concurrency=DEFAULT_PROBE_CONCURRENCY, queue_size=None, limiter=None,
+               metrics=None):
+    probe_concurrency = max(1, probe_concurrency)
+    found = queue.Queue(maxsize=queue_size or 2 * probe_concurrency)
+    results = queue.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def discover():
+        try:
+            for item in connect_scan(scheduler, concurrency, limiter, metrics=metrics):
+                if stop.is_set():
+                    item[2].close()
+                    break
+                found.put(item)
+        except Exception as e:
+            results.put(e)
+        for _ in range(probe_concurrency):
+            found.put(done)
+
+    def prober():
+        while True:
+            item = found.get()
+            if item is done:
+                break
+            host, port, s = item
+            with s:
+                if stop.is_set():
+                    continue
+                try:
+                    result = measure(metrics, 'probe', probe, s, host.ip, port,
+                                     host.timing.read_timeout())
+                    host.completed(port, OPEN, result)
+                except Exception as e:
+                    result = e
+            if result is not None:
+                results.put(result if isinstance(result, Exception) else (host.ip, result))
+        results.put(done)
+
+    threads = [threading.Thread(target=discover, daemon=True)]
+    threads += [threading.Thread(target=prober, daemon=True) for _ in range(probe_concurrency)]
+    for t in threads:
+        t.start()
+    deadline = scheduler.deadline
+    try:
+        remaining = probe_concurrency
+        while remaining:
+            try:
+                result = results.get(timeout=deadline and deadline.abort_in())
+            except queue.Empty:
+                deadline.partial = True
+                break
+            if result is done:
+                remaining -= 1
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                yield result
+    finally:
+        stop.set()
+
+# Single-host form of scan_hosts, yielding the probe results only
+def scan_ports(ip, ports, probe, concurrency=DEFAULT_CONCURRENCY, timing=None,
+               probe_concurrency=DEFAULT_PROBE_CONCURRENCY, queue_size=None,
+               window=None, limiter=None):
+    scheduler = single_host(ip, ports, concurrency, timing, window)
+    for _, result in scan_hosts(scheduler, probe, concurrency, probe_concurrency,
+                                queue_size, limiter):
+        yield result
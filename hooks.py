@@ -0,0 +1,137 @@
+import re
+import shlex
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# Follow-up checks started while the scan is still running.
+#
+# A hook pairs a regular expression over the service name of an open port
+# with an action. Every reported port is matched against the hooks and the
+# actions it triggers are queued on a pool of `parallelism` threads at once,
+# so checks overlap the rest of the scan and the whole assessment takes about
+# as long as the longer of the two. Each check runs once: command hooks are
+# keyed by their expanded command line, so a script that only takes the host
+# runs once per host however many matching ports it has.
+
+DEFAULT_PARALLELISM = 4
+DEFAULT_TIMEOUT = 300.0
+
+# The checks nmapVsScript/portscan_py.sh runs once the scan is over
+DEFAULT_HOOKS = [
+    ('ssh', 'bash sshdowngrade.sh {ip}'),
+    ('ssh', 'bash sshattempt.sh {ip}'),
+    ('ssl|https|ftps', 'bash sslversion.sh {ip}'),
+]
+
+# The fields of a command template; any other brace is left as it is, for
+# awk programs and ${VAR}
+PLACEHOLDER = re.compile(r'\{(ip|port|proto|service)\}')
+
+# status is e.g. "exit 0" or "timed out", output what the check printed
+Check = namedtuple('Check', ['name', 'ip', 'result', 'status', 'output', 'duration'])
+
+# "SERVICE=COMMAND" from the command line
+def parse_hook(spec):
+    service, sep, command = spec.partition('=')
+    if not sep or not service or not command:
+        raise ValueError(f"hook must look like SERVICE=COMMAND: {spec}")
+    try:
+        re.compile(service)
+    except re.error as e:
+        raise ValueError(f"invalid service pattern {service}: {e}") from None
+    field = re.search(r'\{(ip|port|proto|service)[:!][^}]*\}', command)
+    if field:
+        raise ValueError(f"hook fields take no format spec: {field.group(0)}")
+    return service, command
+
+# `template` with its fields replaced by the (quoted) values of the port
+def expand(template, ip, result):
+    values = {'ip': shlex.quote(ip), 'port': str(result.port), 'proto': result.proto,
+              'service': shlex.quote(result.service or '')}
+    return PLACEHOLDER.sub(lambda match: values[match.group(1)], template)
+
+class Hook:
+    # `action(ip, result)` returns (status, output)
+    def __init__(self, service, action, name=None):
+        self.service = re.compile(service)
+        self.action = action
+        self.name = name or getattr(action, '__name__', 'hook')
+
+    def matches(self, result):
+        return result.service is not None and self.service.search(result.service) is not None
+
+    # Checks with the same key run once
+    def key(self, ip, result):
+        return (self.name, ip, result.port, result.proto)
+
+    def describe(self, ip, result):
+        return self.name
+
+# Runs a shell command; {ip}, {port}, {proto} and {service} in `template`
+# are replaced by the (quoted) values of the port that triggered it
+class CommandHook(Hook):
+    def __init__(self, service, template, timeout=DEFAULT_TIMEOUT):
+        super().__init__(service, self.run_command)
+        self.template = template
+        self.timeout = timeout
+
+    def command(self, ip, result):
+        return expand(self.template, ip, result)
+
+    def key(self, ip, result):
+        return self.command(ip, result)
+
+    def describe(self, ip, result):
+        return self.command(ip, result)
+
+    def run_command(self, ip, result):
+        try:
+            done = subprocess.run(self.command(ip, result), shell=True, capture_output=True,
+                                  text=True, errors='replace', timeout=self.timeout)
+        except subprocess.TimeoutExpired as e:
+            output = e.output or ''
+            return "timed out", output if isinstance(output, str) else output.decode(errors='replace')
+        return f"exit {done.returncode}", done.stdout + done.stderr
+
+class HookRunner:
+    # `report(check)` is called from a pool thread as each check finishes, or
+    # from submit() for one that could not be started
+    def __init__(self, hooks, parallelism=DEFAULT_PARALLELISM, report=print):
+        self.hooks = hooks
+        self.report = report
+        self.executor = ThreadPoolExecutor(max_workers=max(1, parallelism))
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    # Queues the checks `result` triggers and returns at once. A hook that
+    # fails to start is reported as a failed check and never stops the scan.
+    def submit(self, ip, result):
+        for hook in self.hooks:
+            try:
+                if not hook.matches(result):
+                    continue
+                key = hook.key(ip, result)
+                with self.lock:
+                    if key in self.seen:
+                        continue
+                    self.seen.add(key)
+                self.executor.submit(self.run, hook, ip, result)
+            except Exception as e:
+                self.report(Check(hook.name, ip, result, f"failed: {e}", '', 0.0))
+
+    def run(self, hook, ip, result):
+        st = time.monotonic()
+        name = hook.describe(ip, result)
+        try:
+            status, output = hook.action(ip, result)
+        except Exception as e:
+            status, output = f"failed: {e}", ''
+        self.report(Check(name, ip, result, status, output, time.monotonic() - st))
+
+    # Waits for every queued check; returns how many ran
+    def wait(self):
+        self.executor.shutdown(wait=True)
+        return len(self.seen)
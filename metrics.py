@@ -0,0 +1,257 @@
+import errno
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+# Live scan metrics (--progress, --stats-json, --stats-prometheus).
+#
+# The engines report each stage of every probe here: a TCP connect, the
+# service probe of an open port (banner read, TLS handshake and probes) and a
+# UDP probe. ScanMetrics counts what is in flight per stage and the outcome of
+# each finished attempt (open, refused, timeout or error for a connect) and
+# keeps a latency histogram per stage, with Prometheus' cumulative buckets.
+# Ports whose final state is known are counted against the scan's total, which
+# gives the completion rate and the ETA. A Reporter thread takes a snapshot
+# every `interval` seconds and prints it as a progress line, appends it to a
+# JSON Lines file and rewrites a Prometheus textfile (for node_exporter's
+# textfile collector), so concurrency and timeouts can be tuned from data.
+
+DEFAULT_INTERVAL = 5.0
+STAGES = ('connect', 'probe', 'udp')
+# Latency bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TIMED_OUT = (errno.EAGAIN, errno.EWOULDBLOCK, errno.ETIMEDOUT)
+
+# Outcome of a connect that finished with errno `err` (0 = connected)
+def connect_outcome(err):
+    if err == 0:
+        return 'open'
+    if err == errno.ECONNREFUSED:
+        return 'refused'
+    if err in TIMED_OUT:
+        return 'timeout'
+    return 'error'
+
+class Histogram:
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    # Upper bound of the bucket holding quantile `q`, None when empty or
+    # beyond the last bound
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def cumulative(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+class ScanMetrics:
+    # `total` is the number of ports the scan has to settle, over all hosts
+    def __init__(self, total=0):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.total = total
+        self.done = 0
+        self.inflight = Counter()   # stage -> attempts in flight
+        self.outcomes = Counter()   # (stage, outcome) -> finished attempts
+        self.latency = {stage: Histogram() for stage in STAGES}
+        self.last = (self.start, 0)
+
+    # `n` more ports to settle, for a scan added to those counted
+    def expect(self, n):
+        with self.lock:
+            self.total += n
+
+    def started(self, stage):
+        with self.lock:
+            self.inflight[stage] += 1
+
+    # An attempt of `stage` took `seconds` and ended with `outcome`; an
+    # attempt abandoned before it finished only leaves the in-flight count
+    def finished(self, stage, seconds, outcome=None):
+        with self.lock:
+            self.inflight[stage] -= 1
+            if outcome is not None:
+                self.outcomes[(stage, outcome)] += 1
+                self.latency[stage].observe(seconds)
+
+    # Times the block as an attempt of `stage`: 'done' if it returns,
+    # 'failed' if it raises
+    @contextmanager
+    def attempt(self, stage):
+        self.started(stage)
+        st = time.monotonic()
+        outcome = None
+        try:
+            yield
+            outcome = 'done'
+        except Exception:
+            outcome = 'failed'
+            raise
+        finally:
+            self.finished(stage, time.monotonic() - st, outcome)
+
+    # The final state of `n` ports is known
+    def completed(self, n=1):
+        with self.lock:
+            self.done += n
+
+    # Current values as a dict; the rate is that since the previous snapshot
+    def snapshot(self):
+        with self.lock:
+            now = time.monotonic()
+            since, done_then = self.last
+            self.last = (now, self.done)
+            elapsed = now - self.start
+            rate = (self.done - done_then) / (now - since) if now > since else 0.0
+            if not rate and elapsed:
+                rate = self.done / elapsed
+            remaining = max(0, self.total - self.done)
+            return {
+                'time': round(time.time(), 3),
+                'elapsed': round(elapsed, 3),
+                'total': self.total,
+                'done': self.done,
+                'rate': round(rate, 1),
+                'eta': round(remaining / rate, 1) if rate else (None if remaining else 0.0),
+                'inflight': {stage: self.inflight[stage] for stage in STAGES},
+                'outcomes': {stage: {outcome: count for (s, outcome), count in sorted(self.outcomes.items())
+                                     if s == stage}
+                             for stage in STAGES},
+                'latency': {stage: {'count': h.count, 'sum': round(h.sum, 6),
+                                    'p50': h.quantile(0.5), 'p90': h.quantile(0.9),
+                                    'p99': h.quantile(0.99),
+                                    'buckets': dict(zip([*map(str, h.bounds), '+Inf'], h.cumulative()))}
+                            for stage, h in self.latency.items()},
+            }
+
+# fn(*args), timed as an attempt of `stage` unless `metrics` is None
+def measure(metrics, stage, fn, *args):
+    if metrics is None:
+        return fn(*args)
+    with metrics.attempt(stage):
+        return fn(*args)
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '?'
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+def format_latency(seconds):
+    return '?' if seconds is None else f"{seconds * 1000:g}ms"
+
+# nmap "Stats:" style one-line summary of a snapshot
+def progress_line(snap):
+    percent = 100 * snap['done'] / snap['total'] if snap['total'] else 100
+    connects = snap['outcomes']['connect']
+    inflight = snap['inflight']
+    latency = snap['latency']['connect']
+    line = (f"Stats: {format_seconds(snap['elapsed'])} elapsed; {snap['done']}/{snap['total']} ports "
+            f"({percent:.1f}%), {snap['rate']:g}/s; in flight: {inflight['connect']} connects, "
+            f"{inflight['probe']} probes")
+    if inflight['udp']:
+        line += f", {inflight['udp']} udp"
+    line += (f"; {connects.get('open', 0)} open, {connects.get('refused', 0)} refused, "
+             f"{connects.get('timeout', 0)} timed out, {connects.get('error', 0)} errors; "
+             f"connect p50 <= {format_latency(latency['p50'])}, p99 <= {format_latency(latency['p99'])}; "
+             f"ETA {format_seconds(snap['eta'])}")
+    return line
+
+def prometheus_text(snap):
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP portscan_{name} {help_text}")
+        lines.append(f"# TYPE portscan_{name} {kind}")
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{val}"' for key, val in labels)
+            lines.append(f"portscan_{name}{{{label_text}}} {value}" if label_text
+                         else f"portscan_{name} {value}")
+
+    metric('ports', 'gauge', 'Ports the scan has to settle.', [((), snap['total'])])
+    metric('ports_done', 'gauge', 'Ports whose final state is known.', [((), snap['done'])])
+    metric('ports_per_second', 'gauge', 'Ports settled per second since the previous update.',
+           [((), snap['rate'])])
+    metric('elapsed_seconds', 'gauge', 'Seconds since the scan started.', [((), snap['elapsed'])])
+    if snap['eta'] is not None:
+        metric('eta_seconds', 'gauge', 'Estimated seconds until the scan is done.', [((), snap['eta'])])
+    metric('inflight', 'gauge', 'Attempts in flight per stage.',
+           [((('stage', stage),), count) for stage, count in snap['inflight'].items()])
+    metric('attempts_total', 'counter', 'Finished attempts per stage and outcome.',
+           [((('stage', stage), ('outcome', outcome)), count)
+            for stage, outcomes in snap['outcomes'].items() for outcome, count in outcomes.items()])
+    metric('latency_seconds', 'histogram', 'Latency of finished attempts per stage.', [])
+    for stage, h in snap['latency'].items():
+        for bound, count in h['buckets'].items():
+            lines.append(f'portscan_latency_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'portscan_latency_seconds_sum{{stage="{stage}"}} {h["sum"]}')
+        lines.append(f'portscan_latency_seconds_count{{stage="{stage}"}} {h["count"]}')
+    return '\n'.join(lines) + '\n'
+
+# Atomically replaces `path`, so a collector never reads half a file
+def replace_file(path, text):
+    temp = f"{path}.tmp"
+    with open(temp, 'w') as f:
+        f.write(text)
+    os.replace(temp, path)
+
+class Reporter:
+    # `progress` is a stream for the progress line (or None), `json_path` and
+    # `prometheus_path` the optional stats files
+    def __init__(self, metrics, interval=DEFAULT_INTERVAL, progress=None, json_path=None,
+                 prometheus_path=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.progress = progress
+        self.json_file = open(json_path, 'w') if json_path else None
+        self.prometheus_path = prometheus_path
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def loop(self):
+        while not self.stop.wait(self.interval):
+            self.report()
+
+    def report(self):
+        snap = self.metrics.snapshot()
+        if self.progress is not None:
+            print(progress_line(snap), file=self.progress, flush=True)
+        if self.json_file is not None:
+            self.json_file.write(json.dumps(snap) + '\n')
+            self.json_file.flush()
+        if self.prometheus_path:
+            replace_file(self.prometheus_path, prometheus_text(snap))
+
+    # Stops the thread and writes the final snapshot; closing again does nothing
+    def close(self):
+        if self.stop.is_set():
+            return
+        self.stop.set()
+        self.thread.join()
+        self.report()
+        if self.json_file is not None:
+            self.json_file.close()
@@ -0,0 +1,169 @@
+import json
+import queue
+import threading
+import time
+from collections import namedtuple
+from xml.sax.saxutils import quoteattr
+import portstates
+
+# Machine-readable output, streamed as the scan goes.
+#
+# Each finding becomes one record the moment it is reported: a JSON object
+# per line or an nmap grepable "Host: ... Ports: ..." line. XML groups the
+# findings of a host into one nmap <host> element, written when host_done()
+# says the host's scan has finished; every scanned host gets one, with the
+# ports not reported open summed up in <extraports>. Writers never block the scan: emit()
+# and host_done() only queue the record, and a thread per output formats and
+# writes them to a buffered file, flushing whenever the queue runs empty, so
+# a reader tailing the file sees every record within one batch. The XML
+# document is closed with nmap's <runstats> when the scan ends, after the
+# elements of any host that never finished; until then each <host> element
+# is complete on its own.
+
+BUFFER_SIZE = 64 * 1024
+
+# Queued by host_done(); `extraports` holds (proto, state, count, reason) of
+# the host's ports that were not reported open
+HostDone = namedtuple('HostDone', ['extraports'])
+
+def reason(result):
+    reasons = portstates.UDP_REASONS if result.proto == 'udp' else portstates.REASONS
+    return reasons[portstates.OPEN]
+
+class JsonLines:
+    def header(self, command, start, protocols):
+        return ''
+
+    def record(self, ip, result, when):
+        return json.dumps({'time': round(when, 3), 'ip': ip, **result._asdict()}) + '\n'
+
+    def host_done(self, ip, extraports, when):
+        return ''
+
+    def footer(self, hosts, start, end, partial):
+        return ''
+
+# nmap -oG style, one "Ports:" line per finding
+class Grepable:
+    def header(self, command, start, protocols):
+        return f"# thread_scan started {time.ctime(start)} as: {command}\n"
+
+    def record(self, ip, result, when):
+        version = (result.version or '').replace('/', '|')
+        return (f"Host: {ip} ()\tPorts: {result.port}/{result.state}/{result.proto}//"
+                f"{result.service or ''}//{version}/\n")
+
+    def host_done(self, ip, extraports, when):
+        return ''
+
+    def footer(self, hosts, start, end, partial):
+        note = " (partial)" if partial else ""
+        return (f"# thread_scan done at {time.ctime(end)} -- {hosts} hosts scanned in "
+                f"{end - start:.2f} seconds{note}\n")
+
+# nmap -oX style, one <host> element per host holding all of its findings
+class NmapXml:
+    def __init__(self):
+        self.hosts = {}  # ip -> (time of the first finding, [PortResult]), until the host is done
+
+    def header(self, command, start, protocols):
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<nmaprun scanner="thread_scan" args={quoteattr(command)} start="{int(start)}" '
+                f'startstr={quoteattr(time.ctime(start))} xmloutputversion="1.05">\n'
+                + ''.join(f'<scaninfo type="{"udp" if proto == "udp" else "connect"}" protocol="{proto}"/>\n'
+                          for proto in protocols))
+
+    def record(self, ip, result, when):
+        self.hosts.setdefault(ip, (when, []))[1].append(result)
+        return ''
+
+    def host_done(self, ip, extraports, when):
+        start, found = self.hosts.pop(ip, (when, []))
+        addrtype = 'ipv6' if ':' in ip else 'ipv4'
+        return (f'<host starttime="{int(start)}" endtime="{int(when)}"><status state="up" reason="user-set"/>\n'
+                f'<address addr={quoteattr(ip)} addrtype="{addrtype}"/>\n<ports>'
+                + ''.join(f'<extraports state="{state}" count="{count}">'
+                          f'<extrareasons reason="{reason}" count="{count}" proto="{proto}"/></extraports>\n'
+                          for proto, state, count, reason in extraports)
+                + ''.join(map(port_element, sorted(found, key=lambda result: (result.proto, result.port))))
+                + '</ports>\n</host>\n')
+
+    def footer(self, hosts, start, end, partial):
+        summary = f"{hosts} hosts scanned in {end - start:.2f} seconds"
+        if partial:
+            summary += "; stopped at the time limit, results are partial"
+        return (''.join(self.host_done(ip, (), end) for ip in list(self.hosts))
+                + '<runstats>'
+                f'<finished time="{int(end)}" timestr={quoteattr(time.ctime(end))} '
+                f'elapsed="{end - start:.2f}" summary={quoteattr(summary)} exit="success"/>'
+                f'<hosts up="{hosts}" down="0" total="{hosts}"/></runstats>\n'
+                '</nmaprun>\n')
+
+def port_element(result):
+    service = f'<service name={quoteattr(result.service or "unknown")}'
+    if result.version:
+        service += f' product={quoteattr(result.version)} method="probed" conf="10"/>'
+    else:
+        service += ' method="table" conf="3"/>'
+    return (f'<port protocol="{result.proto}" portid="{result.port}">'
+            f'<state state={quoteattr(result.state)} reason="{reason(result)}" reason_ttl="0"/>'
+            f'{service}</port>\n')
+
+FORMATS = {'json': JsonLines, 'grepable': Grepable, 'xml': NmapXml}
+
+class StreamWriter:
+    def __init__(self, path, fmt, command, protocols=('tcp',)):
+        self.file = open(path, 'w', buffering=BUFFER_SIZE)
+        self.format = fmt
+        self.start = time.time()
+        self.records = queue.SimpleQueue()
+        self.error = None
+        self.file.write(fmt.header(command, self.start, protocols))
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+
+    def emit(self, ip, result):
+        self.records.put((ip, result, time.time()))
+
+    # Every finding of `ip` has been emitted; `extraports` as in HostDone
+    def host_done(self, ip, extraports=()):
+        self.records.put((ip, HostDone(extraports), time.time()))
+
+    def drain(self):
+        try:
+            while True:
+                item = self.records.get()
+                while item is not None:
+                    ip, result, when = item
+                    self.file.write(self.format.host_done(ip, result.extraports, when)
+                                    if isinstance(result, HostDone) else self.format.record(ip, result, when))
+                    try:
+                        item = self.records.get_nowait()
+                    except queue.Empty:
+                        break
+                self.file.flush()
+                if item is None:
+                    return
+        except OSError as e:
+            self.error = e
+
+    # Writes the records still queued and, for a scan that ran to its end
+    # (`hosts` given), the format's footer. Write errors surface here; closing
+    # again does nothing.
+    def close(self, hosts=None, partial=False):
+        if self.file.closed:
+            return
+        self.records.put(None)
+        self.thread.join()
+        try:
+            if hosts is not None and self.error is None:
+                self.file.write(self.format.footer(hosts, self.start, time.time(), partial))
+        finally:
+            self.file.close()
+        if self.error is not None:
+            raise self.error
+
+# One StreamWriter per (format name, path) in `outputs`, for a scan of
+# `protocols`
+def open_outputs(outputs, command, protocols=('tcp',)):
+    return [StreamWriter(path, FORMATS[name](), command, protocols) for name, path in outputs if path]
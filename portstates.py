@@ -0,0 +1,98 @@
+import errno
+import threading
+from collections import namedtuple
+
+# Per-port scan states, nmap style. A connect that completes means open, a
+# refusal (RST) means closed, and a timeout or an ICMP error (unreachable,
+# prohibited) means filtered. UDP has no handshake, so a UDP port that never
+# answers may be open as well as filtered: its FILTERED reads open|filtered.
+#
+# PortStates keeps two bits per port of the scan's port list for every host,
+# 2.5 KB per host for 10000 ports, plus running counts per state. Shards of
+# the same port list scanned elsewhere (worker processes, a checkpoint) are
+# combined with merge(): each port is set by one shard only, so their packed
+# arrays simply OR together.
+
+UNKNOWN, OPEN, CLOSED, FILTERED = range(4)
+NAMES = {UNKNOWN: 'unknown', OPEN: 'open', CLOSED: 'closed', FILTERED: 'filtered'}
+REASONS = {OPEN: 'syn-ack', CLOSED: 'conn-refused', FILTERED: 'no-response'}
+UDP_NAMES = {**NAMES, FILTERED: 'open|filtered'}
+UDP_REASONS = {OPEN: 'udp-response', CLOSED: 'port-unreach', FILTERED: 'no-response'}
+
+# A host's packed states, as sent from a worker process to the parent
+HostStates = namedtuple('HostStates', ['packed'])
+
+# State of a connect that finished with errno `err` (0 = connected)
+def connect_state(err):
+    if err == 0:
+        return OPEN
+    if err == errno.ECONNREFUSED:
+        return CLOSED
+    return FILTERED
+
+class PortStates:
+    def __init__(self, ports):
+        self.ports = list(ports)
+        self.index = {port: i for i, port in enumerate(self.ports)}
+        self.size = (len(self.ports) + 3) // 4
+        self.hosts = {}   # ip -> bytearray, 4 ports per byte
+        self.counts = {}  # ip -> [count per state]
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def get(self, ip, port):
+        states = self.hosts.get(ip)
+        if states is None:
+            return UNKNOWN
+        i = self.index[port]
+        return (states[i >> 2] >> ((i & 3) * 2)) & 3
+
+    def mark(self, ip, port, state):
+        i = self.index[port]
+        shift = (i & 3) * 2
+        with self.lock:
+            states = self.hosts.get(ip)
+            if states is None:
+                states = self.hosts[ip] = bytearray(self.size)
+                self.counts[ip] = [len(self.ports), 0, 0, 0]
+            old = (states[i >> 2] >> shift) & 3
+            states[i >> 2] = (states[i >> 2] & ~(3 << shift)) | (state << shift)
+            counts = self.counts[ip]
+            counts[old] -= 1
+            counts[state] += 1
+
+    def count(self, ip, state):
+        counts = self.counts.get(ip)
+        if counts is None:
+            return len(self.ports) if state == UNKNOWN else 0
+        return counts[state]
+
+    # Ports of `ip` in `state`, in scan order
+    def ports_in(self, ip, state):
+        return [port for port in self.ports if self.get(ip, port) == state]
+
+    # Drops the states of `ip`, once a finished host's summary has been printed
+    def forget(self, ip):
+        with self.lock:
+            self.hosts.pop(ip, None)
+            self.counts.pop(ip, None)
+
+    def packed(self, ip):
+        return bytes(self.hosts.get(ip, bytes(self.size)))
+
+    def merge(self, ip, packed):
+        with self.lock:
+            states = self.hosts.setdefault(ip, bytearray(self.size))
+            for i, byte in enumerate(packed):
+                states[i] |= byte
+            counts = self.counts[ip] = [0, 0, 0, 0]
+            for i in range(len(self.ports)):
+                counts[(states[i >> 2] >> ((i & 3) * 2)) & 3] += 1
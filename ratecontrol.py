@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+
+# Send-rate control for the scan engines.
+#
+# RateLimiter is a global packets-per-second ceiling shared by every target.
+# CongestionWindow limits the connects in flight to one target: it grows on
+# answers (slow start up to ssthresh, then one probe per window) and halves
+# when a timeout looks like a drop. A connect scan cannot tell a drop from a
+# filtered port, so a timeout only counts as a drop when the target answered
+# some probe sent after it; at most one cut is taken per window. Targets that
+# never answered anything are treated as filtered and their window keeps
+# growing, so a fully firewalled host is not crawled one port at a time.
+
+INITIAL_CWND = 64
+MIN_CWND = 4
+
+class RateLimiter:
+    def __init__(self, rate, burst=None):
+        self.interval = 1.0 / rate
+        # Up to 10 ms worth of probes may leave back to back; slow rates get a
+        # burst of one, so every probe is paced
+        burst = burst or max(1, rate / 100)
+        self.tolerance = self.interval * (burst - 1)
+        self.tat = 0.0  # theoretical arrival time of the next probe
+        self.lock = threading.Lock()
+
+    # Seconds until the next probe may be sent; 0 means a slot was taken
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.tat, now)
+            wait = start - now - self.tolerance
+            if wait > 0:
+                return wait
+            self.tat = start + self.interval
+            return 0
+
+    # Reserve the next slot and return how long to wait before using it
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.tat, now)
+            self.tat = start + self.interval
+            return max(0, start - now - self.tolerance)
+
+    def wait(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+class CongestionWindow:
+    def __init__(self, initial=INITIAL_CWND, minimum=MIN_CWND, maximum=None):
+        self.minimum = max(1, minimum)
+        self.maximum = maximum or float('inf')
+        self.cwnd = min(max(initial, self.minimum), self.maximum)
+        self.ssthresh = self.maximum
+        self.inflight = 0
+        self.last_response = None
+        self.last_cut = 0.0
+        self.drops = 0
+
+    def available(self):
+        return self.inflight < int(self.cwnd)
+
+    # Take a slot; returns the send time to hand back to answered/timed_out
+    def sent(self):
+        self.inflight += 1
+        return time.monotonic()
+
+    def grow(self):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += 1
+        else:
+            self.cwnd += 1 / self.cwnd
+        self.cwnd = min(self.cwnd, self.maximum)
+
+    def answered(self, sent_at):
+        self.last_response = time.monotonic()
+        self.grow()
+        self.release()
+
+    def timed_out(self, sent_at):
+        if self.last_response is None:
+            self.grow()
+        elif self.last_response > sent_at and sent_at > self.last_cut:
+            self.drops += 1
+            self.ssthresh = max(self.cwnd / 2, self.minimum)
+            self.cwnd = self.ssthresh
+            self.last_cut = time.monotonic()
+        self.release()
+
+    def release(self):
+        self.inflight -= 1
@@ -0,0 +1,60 @@
+import asyncio
+import itertools
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from targets import address_family, parse_ip
+
+# Hostname resolution for scan targets.
+#
+# getaddrinfo blocks, so the hostnames of a target list are resolved as one
+# batch spread over a pool of threads, up to `concurrency` lookups at a time,
+# instead of one after the other. Each distinct name is looked up once per
+# address family and the answers are cached for the life of the process.
+# A name gives its addresses of both families unless one is asked for, so a
+# dual-stack host can be scanned over IPv4 and IPv6 in the same run.
+
+DEFAULT_CONCURRENCY = 64
+
+cache = {}  # (name, family) -> [addresses]
+
+def lookup(name, family):
+    try:
+        infos = socket.getaddrinfo(name, None, family, socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        return []
+    return list(dict.fromkeys(parse_ip(info[4][0]) or info[4][0] for info in infos))
+
+# Returns {name: [addresses]} for `names`, in resolver order; a name that
+# does not resolve maps to an empty list
+async def resolve_all(names, family=socket.AF_UNSPEC, concurrency=DEFAULT_CONCURRENCY):
+    loop = asyncio.get_running_loop()
+    names = list(dict.fromkeys(names))
+    wanted = [name for name in names if (name, family) not in cache]
+    if wanted:
+        executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(wanted))))
+        try:
+            found = await asyncio.gather(*[loop.run_in_executor(executor, lookup, name, family)
+                                           for name in wanted])
+        finally:
+            executor.shutdown(wait=False)
+        for name, addresses in zip(wanted, found):
+            cache[name, family] = addresses
+    return {name: cache[name, family] for name in names}
+
+# Blocking form of resolve_all, for a batch of names met while expanding
+# targets outside an event loop
+def resolve_names(names, family=socket.AF_UNSPEC, concurrency=DEFAULT_CONCURRENCY):
+    names = list(dict.fromkeys(names))
+    wanted = [name for name in names if (name, family) not in cache]
+    if wanted:
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(wanted)))) as executor:
+            for name, addresses in zip(wanted, executor.map(lookup, wanted, itertools.repeat(family))):
+                cache[name, family] = addresses
+    return {name: cache[name, family] for name in names}
+
+# The first address of each family, IPv4 first
+def one_per_family(addresses):
+    first = {}
+    for ip in addresses:
+        first.setdefault(address_family(ip), ip)
+    return [first[family] for family in (socket.AF_INET, socket.AF_INET6) if family in first]
@@ -0,0 +1,22 @@
+from collections import namedtuple
+
+# One scanned port. str() gives the nmap-style line printed by the CLI;
+# records are picklable so worker processes can send them to the parent.
+# A Finding is the open port of a given host, as yielded by scanner.Scanner.
+
+class PortResult(namedtuple('PortResult', ['port', 'proto', 'state', 'service', 'version'])):
+    __slots__ = ()
+
+    def __str__(self):
+        line = f"{self.port}/{self.proto}   {self.state}  {self.service}"
+        return f"{line} {self.version}" if self.version else line
+
+class Finding(namedtuple('Finding', ['ip', 'port', 'proto', 'state', 'service', 'version'])):
+    __slots__ = ()
+
+    @property
+    def result(self):
+        return PortResult(*self[1:])
+
+    def __str__(self):
+        return f"{self.ip}  {self.result}"
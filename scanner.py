@@ -0,0 +1,324 @@
+import asyncio
+import functools
+import socket
+import threading
+import async_scan
+import discovery
+import epoll_scan
+import ratecontrol
+import resolve
+import scheduler
+import service_probes
+import services
+import targets
+import timing
+import tls_info
+import udp_scan
+from portstates import OPEN
+from results import Finding, PortResult
+
+# Library interface to the scan engines.
+#
+# A Scanner is configured once, with the options of the command line as
+# keyword arguments, and then scans any number of target lists, either from
+# plain code:
+#
+#     for finding in scanner.scan(['10.0.0.0/24', 'example.com']): ...
+#
+# or from a running event loop:
+#
+#     async for finding in scanner.scan_async(['10.0.0.1']): ...
+#
+# Each open port is yielded as a results.Finding as soon as it is known.
+# Importing this module does no work. Constructing a Scanner loads what every
+# scan shares: the nmap-services index, the probe file and the TLS client
+# context. The Scanner then keeps its own state warm across scans. This is
+# the RTT estimate of every host it has probed, so a rescan starts from
+# learned timeouts, and its rate limiters, so the ceilings hold over
+# back-to-back scans. Hostname lookups are cached by resolve for the life of
+# the process.
+#
+# Both engines run TCP under the caller's event loop: async natively, epoll
+# in a thread of its own that hands results over to the loop. UDP ports are
+# scanned next to TCP.
+
+ENGINES = ('async', 'epoll')
+TIMING_CACHE_SIZE = 4096
+
+# Identify the service behind an open port and return its PortResult. `s` is
+# the socket that found the port open; every probe reuses it instead of
+# opening a new connection.
+def probe_open_port(s, ip, port, timeout=1, intensity=service_probes.DEFAULT_INTENSITY,
+                    probe_file=service_probes.DEFAULT_PATH, tls_handshake_only=False):
+    try:
+        service, version = service_probes.identify(s, ip, port, timeout, intensity, probe_file,
+                                                   tls_handshake_only)
+    except Exception:
+        service, version = None, None
+    return PortResult(port, 'tcp', 'open', service or services.service_name(port, 'tcp'), version)
+
+def udp_result(port, reply, probe_file=service_probes.DEFAULT_PATH):
+    service, version = service_probes.identify_udp(port, reply, probe_file)
+    return PortResult(port, 'udp', 'open', service or services.service_name(port, 'udp'), version)
+
+# Yields the items of async generators `sources` as each produces them; an
+# exception raised in one is re-raised here. Closing the merge cancels the
+# tasks draining the sources and waits for them, so every source has run its
+# cleanup by the time it returns.
+async def merge(sources):
+    items = asyncio.Queue()
+    done = object()
+
+    async def drain(source):
+        try:
+            async for item in source:
+                await items.put(item)
+        except Exception as e:
+            await items.put(e)
+        finally:
+            await items.put(done)
+
+    tasks = [asyncio.create_task(drain(source)) for source in sources]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            item = await items.get()
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # a source the cancellation reached has unwound already; only one
+        # left waiting at a yield still has cleanup to run, and with its
+        # task finished nothing is iterating it any more
+        for source in sources:
+            await source.aclose()
+
+class Scanner:
+    # `ports` and `udp_ports` are the default port lists of scan() (any
+    # iterable). `timing_template` is a timing.TimingTemplate or a template
+    # number or name; the other options match those of thread_scan.
+    # `scan_metrics` is an optional metrics.ScanMetrics fed by every scan.
+    def __init__(self, ports=range(1, 10001), udp_ports=(), engine='async',
+                 timing_template=timing.DEFAULT_TEMPLATE, concurrency=None,
+                 probe_concurrency=async_scan.DEFAULT_PROBE_CONCURRENCY, connect_timeout=None,
+                 probe_timeout=None, max_rate=None, udp_max_rate=None, max_host_rate=None,
+                 min_parallelism=ratecontrol.MIN_CWND, max_host_parallelism=None,
+                 host_group=scheduler.DEFAULT_HOST_GROUP, filtered_limit=None,
+                 version_intensity=service_probes.DEFAULT_INTENSITY,
+                 probe_file=service_probes.DEFAULT_PATH, tls_handshake_only=False,
+                 udp_retries=udp_scan.DEFAULT_RETRIES, discover=False,
+                 ping_ports=discovery.DEFAULT_PING_PORTS, ping_timeout=None,
+                 family=socket.AF_UNSPEC, all_addresses=False,
+                 dns_concurrency=resolve.DEFAULT_CONCURRENCY, max_scan_time=None,
+                 grace_period=scheduler.DEFAULT_GRACE, scan_metrics=None):
+        if engine not in ENGINES:
+            raise ValueError(f"unknown engine: {engine}")
+        if not isinstance(timing_template, timing.TimingTemplate):
+            timing_template = timing.get_template(timing_template)
+        self.ports = port_list(ports)
+        self.udp_ports = port_list(udp_ports)
+        self.engine = engine
+        self.template = timing_template
+        self.concurrency = concurrency or async_scan.default_concurrency()
+        if timing_template.max_parallelism:
+            self.concurrency = min(self.concurrency, timing_template.max_parallelism)
+        self.probe_concurrency = probe_concurrency
+        self.connect_timeout = connect_timeout
+        self.probe_timeout = probe_timeout
+        max_rate = max_rate or timing_template.max_rate
+        self.limiter = ratecontrol.RateLimiter(max_rate) if max_rate else None
+        udp_max_rate = udp_max_rate or max_rate
+        self.udp_limiter = ratecontrol.RateLimiter(udp_max_rate) if udp_max_rate else None
+        self.max_host_rate = max_host_rate
+        self.min_parallelism = min_parallelism
+        self.max_host_parallelism = max_host_parallelism
+        self.host_group = host_group
+        self.filtered_limit = filtered_limit
+        self.probe_file = probe_file
+        self.probe = functools.partial(probe_open_port, intensity=version_intensity,
+                                       probe_file=probe_file, tls_handshake_only=tls_handshake_only)
+        self.udp_retries = udp_retries
+        self.discover = discover
+        self.ping_ports = list(ping_ports)
+        self.ping_timeout = ping_timeout or timing_template.initial_rtt_timeout
+        self.family = family
+        self.all_addresses = all_addresses
+        self.dns_concurrency = dns_concurrency
+        self.max_scan_time = max_scan_time
+        self.grace_period = grace_period
+        self.metrics = scan_metrics
+        self.timings = {}  # ip -> timing.HostTiming
+        self.warm()
+
+    # Loads the state shared by every scan, so the first one pays nothing extra
+    def warm(self):
+        services.get_index()
+        service_probes.get_registry(self.probe_file)
+        service_probes.get_registry(self.probe_file, 'UDP')
+        tls_info.get_context()
+
+    # Yields a Finding for every open port of `targets` (addresses, blocks,
+    # octet ranges or hostnames, as on the command line) as soon as it is
+    # found. `ports` and `udp_ports` replace the Scanner's lists for this scan.
+    def scan(self, targets, ports=None, udp_ports=None):
+        loop = asyncio.new_event_loop()
+        findings = self.scan_async(targets, ports, udp_ports)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(findings.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(findings.aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    # Asynchronous form of scan(), run on the caller's event loop
+    async def scan_async(self, targets, ports=None, udp_ports=None):
+        ports = self.ports if ports is None else port_list(ports)
+        udp_ports = self.udp_ports if udp_ports is None else port_list(udp_ports)
+        hosts = await self.resolve(targets)
+        if self.discover and hosts:
+            up = set(await discovery.discover_hosts(hosts, self.ping_ports, self.ping_timeout))
+            hosts = [ip for ip in hosts if ip in up]
+        if not hosts:
+            return
+        if self.metrics is not None:
+            self.metrics.expect(len(hosts) * (len(ports) + len(udp_ports)))
+        deadline = None
+        if self.max_scan_time is not None:
+            deadline = scheduler.Deadline(self.max_scan_time, self.grace_period)
+        sources = []
+        if ports:
+            sources.append(self.scan_tcp(hosts, ports, deadline))
+        if udp_ports:
+            sources.append(self.scan_udp(hosts, udp_ports, deadline))
+        findings = merge(sources)
+        try:
+            async for finding in findings:
+                yield finding
+        finally:
+            await findings.aclose()
+
+    # Addresses of `specs` in order, hostnames resolved in one batch to their
+    # first address of each family (or all of them); names that do not
+    # resolve are left out
+    async def resolve(self, specs):
+        if isinstance(specs, str):
+            specs = [specs]
+        specs = list(targets.iter_targets(specs))
+        names = [spec for spec in specs if targets.parse_ip(spec) is None]
+        resolved = {}
+        if names:
+            resolved = await resolve.resolve_all(names, self.family, self.dns_concurrency)
+        hosts = []
+        for spec in specs:
+            ip = targets.parse_ip(spec)
+            if ip is not None:
+                hosts.append(ip)
+            elif self.all_addresses:
+                hosts.extend(resolved[spec])
+            else:
+                hosts.extend(resolve.one_per_family(resolved[spec]))
+        return list(dict.fromkeys(hosts))
+
+    # The host's timing, kept from earlier scans
+    def host_timing(self, ip):
+        host_timing = self.timings.get(ip)
+        if host_timing is None:
+            if len(self.timings) >= TIMING_CACHE_SIZE:
+                self.timings.clear()
+            host_timing = self.timings[ip] = timing.HostTiming(self.template, self.connect_timeout,
+                                                               self.probe_timeout)
+        return host_timing
+
+    def new_host(self, ip, ports):
+        limiter = ratecontrol.RateLimiter(self.max_host_rate) if self.max_host_rate else None
+        window = ratecontrol.CongestionWindow(minimum=self.min_parallelism,
+                                              maximum=self.max_host_parallelism or self.concurrency)
+        progress = None
+        if self.metrics is not None:
+            progress = lambda ip, port, state, result=None: self.metrics.completed()
+        return scheduler.HostState(ip, ports, self.host_timing(ip), window, limiter, progress,
+                                   self.filtered_limit)
+
+    async def scan_tcp(self, hosts, ports, deadline):
+        work = scheduler.Scheduler(hosts, ports, self.new_host, self.host_group, deadline)
+        if self.engine == 'async':
+            results = async_scan.scan_hosts(work, self.probe, self.concurrency, self.probe_concurrency,
+                                            limiter=self.limiter, metrics=self.metrics)
+        else:
+            results = self.scan_epoll(work)
+        try:
+            async for ip, result in results:
+                yield Finding(ip, *result)
+        finally:
+            await results.aclose()
+
+    # Runs the epoll engine in a thread and yields its results on this loop
+    async def scan_epoll(self, work):
+        loop = asyncio.get_running_loop()
+        results = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def hand_over(item):
+            try:
+                loop.call_soon_threadsafe(results.put_nowait, item)
+            except RuntimeError:
+                # the loop is gone: nobody is waiting for the scan any more
+                stop.set()
+
+        def run():
+            try:
+                found = epoll_scan.scan_hosts(work, self.probe, self.concurrency, self.probe_concurrency,
+                                              limiter=self.limiter, metrics=self.metrics)
+                try:
+                    for item in found:
+                        if stop.is_set():
+                            return
+                        hand_over(item)
+                finally:
+                    found.close()
+                hand_over(done)
+            except Exception as e:
+                hand_over(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        try:
+            while True:
+                item = await results.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            work.stop()
+
+    async def scan_udp(self, hosts, ports, deadline):
+        payload = functools.partial(service_probes.udp_payload, probe_file=self.probe_file)
+        new_timing = lambda: timing.HostTiming(self.template, self.connect_timeout, self.probe_timeout)
+        results = udp_scan.scan_hosts(hosts, ports, payload, new_timing,
+                                      min(self.concurrency, udp_scan.DEFAULT_CONCURRENCY),
+                                      self.udp_retries, self.udp_limiter, deadline, self.metrics)
+        try:
+            async for ip, port, state, reply in results:
+                if self.metrics is not None:
+                    self.metrics.completed()
+                if state == OPEN:
+                    yield Finding(ip, *udp_result(port, reply, self.probe_file))
+        finally:
+            await results.aclose()
+
+# A range is kept as it is, any other iterable of ports becomes a list
+def port_list(ports):
+    return ports if isinstance(ports, range) else list(ports)
@@ -0,0 +1,135 @@
+import time
+from collections import deque
+from portstates import FILTERED
+from ratecontrol import CongestionWindow
+from timing import HostTiming
+
+# Global (host, port) scheduler shared by every target of a scan.
+#
+# Up to `host_group` hosts are active at once; new ones are pulled from the
+# (possibly huge, lazily expanded) target iterator as earlier ones run out of
+# ports. next_probe() walks the active hosts round-robin and hands out the
+# next port of the first host whose congestion window (and optional per-host
+# rate limiter) has room, so a slow or filtered host never idles the workers
+# while per-host politeness limits still hold.
+
+DEFAULT_HOST_GROUP = 256
+DEFAULT_GRACE = 5.0
+
+# Time box of a whole scan. Once `seconds` have passed no new probe is issued;
+# probes already in flight get `grace` more seconds to finish before the
+# engines give up on them. `partial` is set when work was left undone.
+class Deadline:
+    def __init__(self, seconds, grace=DEFAULT_GRACE):
+        self.stop_at = time.monotonic() + seconds
+        self.abort_at = self.stop_at + grace
+        self.partial = False
+
+    def expired(self):
+        return time.monotonic() >= self.stop_at
+
+    # Seconds left before in-flight work is abandoned
+    def abort_in(self):
+        return max(0, self.abort_at - time.monotonic())
+
+class HostState:
+    # `progress(ip, port, state, result)` is called as each port is finished.
+    # With `filtered_limit`, a host that lets that many probes time out
+    # without answering any is taken as fully filtered and not probed further.
+    def __init__(self, ip, ports, timing=None, window=None, limiter=None, progress=None,
+                 filtered_limit=None):
+        self.ip = ip
+        self.ports = iter(ports)
+        self.timing = timing or HostTiming()
+        self.window = window or CongestionWindow()
+        self.limiter = limiter
+        self.progress = progress
+        self.filtered_limit = filtered_limit
+        self.answered = 0
+        self.filtered = 0
+        self.exhausted = False
+
+    def finished(self):
+        return self.exhausted and self.window.inflight == 0
+
+    def looks_filtered(self):
+        return self.answered == 0 and self.filtered >= self.filtered_limit
+
+    # Called by the engines once the final portstates state of `port` is
+    # known; `result` is the probe result of an open port
+    def completed(self, port, state, result=None):
+        if state == FILTERED:
+            self.filtered += 1
+        else:
+            self.answered += 1
+        if self.filtered_limit and not self.exhausted and self.looks_filtered():
+            self.exhausted = True
+        if self.progress is not None:
+            self.progress(self.ip, port, state, result)
+
+class Scheduler:
+    # `ports` must be re-iterable (a range or list) when there are several
+    # hosts. `new_host(ip, ports)` builds the HostState of each target. An
+    # optional Deadline stops handing out probes once it expires.
+    def __init__(self, hosts, ports, new_host=HostState, host_group=DEFAULT_HOST_GROUP,
+                 deadline=None):
+        self.hosts = iter(hosts)
+        self.ports = ports
+        self.new_host = new_host
+        self.host_group = max(1, host_group)
+        self.active = deque()
+        self.hosts_exhausted = False
+        self.deadline = deadline
+        self.stopped = False
+
+    # Hands out no further probes; those in flight still finish
+    def stop(self):
+        self.stopped = True
+
+    def refill(self):
+        while len(self.active) < self.host_group and not self.hosts_exhausted:
+            ip = next(self.hosts, None)
+            if ip is None:
+                self.hosts_exhausted = True
+            else:
+                self.active.append(self.new_host(ip, self.ports))
+
+    # Returns (host, port) and takes a slot of the host's window, or
+    # (None, delay) when every active host is busy: wait `delay` seconds (or,
+    # if delay is None, until an in-flight probe completes) and ask again.
+    # Returns None once every port of every host has been handed out, once
+    # the deadline has expired, or once the scan was stopped.
+    def next_probe(self):
+        if self.stopped:
+            return None
+        if self.deadline is not None and self.deadline.expired():
+            if self.active or not self.hosts_exhausted:
+                self.deadline.partial = True
+            return None
+        while True:
+            self.refill()
+            delay = None
+            for _ in range(len(self.active)):
+                host = self.active[0]
+                self.active.rotate(-1)
+                if host.exhausted or not host.window.available():
+                    continue
+                if host.limiter is not None:
+                    wait = host.limiter.try_acquire()
+                    if wait:
+                        delay = wait if delay is None else min(delay, wait)
+                        continue
+                port = next(host.ports, None)
+                if port is None:
+                    host.exhausted = True
+                    continue
+                host.window.sent()
+                return host, port
+            exhausted = [host for host in self.active if host.exhausted]
+            if not exhausted:
+                break
+            for host in exhausted:
+                self.active.remove(host)
+        if not self.active and self.hosts_exhausted:
+            return None
+        return None, delay
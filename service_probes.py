@@ -0,0 +1,339 @@
+import os
+import re
+import socket
+import time
+import tls_info
+
+# Service and version detection driven by a probe file in nmap's
+# nmap-service-probes syntax (the default `service-probes` file next to this
+# module holds a small subset).
+#
+# Every probe has a payload, a rarity (1 = common, 9 = exotic), port hints and
+# a list of precompiled match rules. An open port is identified on the one
+# connection that found it open:
+#   - ports hinted by the NULL probe (ssh, ftp, smtp...) and ports no probe
+#     knows first wait passively for a banner, the others go straight to the
+#     best probe for the port, so an HTTP port never waits for a banner;
+#   - probes are tried in order of port hints, then rarity, up to the
+#     version intensity; silence moves on to the next probe, any answer ends
+#     the search;
+#   - a response is checked against the probe's rules, its fallback probes'
+#     and the NULL probe's, stopping at the first hard match; a softmatch
+#     only names the service.
+# Ports in a probe's sslports are spoken to through TLS (see tls_info), or
+# identified from the TLS handshake alone on request. Results are cached
+# per (probe, response), so the same banner seen on many hosts is only
+# matched once. UDP probes give the datagram the UDP engine sends to the
+# ports they are hinted for, and their rules identify the reply.
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'service-probes')
+DEFAULT_INTENSITY = 7
+MAX_PROBES = 2       # probes sent on one connection after the banner wait
+CACHE_SIZE = 4096
+READ_SIZE = 4096
+
+ESCAPES = {'\\': '\\', '0': '\0', 'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n',
+           'r': '\r', 't': '\t', 'v': '\v'}
+TEMPLATE_VARIABLE = re.compile(r'\$P\((\d)\)|\$SUBST\((\d),"([^"]*)","([^"]*)"\)|\$(\d)')
+
+def unescape(text):
+    out = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == '\\' and i + 1 < len(text):
+            nxt = text[i + 1]
+            if nxt == 'x' and i + 3 < len(text):
+                out.append(chr(int(text[i + 2:i + 4], 16)))
+                i += 4
+                continue
+            out.append(ESCAPES.get(nxt, nxt))
+            i += 2
+            continue
+        out.append(c)
+        i += 1
+    return ''.join(out).encode('latin-1')
+
+def parse_port_list(spec):
+    ports = set()
+    for part in spec.split(','):
+        first, sep, last = part.strip().partition('-')
+        if first.isdigit():
+            ports.update(range(int(first), int(last if sep else first) + 1))
+    return ports
+
+# Split "p/OpenSSH/ v/$2/ i/protocol $1/" into {'p': 'OpenSSH', ...}
+def parse_version_info(text):
+    fields = {}
+    i = 0
+    while i < len(text):
+        if text[i].isspace():
+            i += 1
+            continue
+        name = 'cpe' if text.startswith('cpe:', i) else text[i]
+        i += len(name) + (1 if name == 'cpe' else 0)
+        if i >= len(text):
+            break
+        delimiter = text[i]
+        end = text.find(delimiter, i + 1)
+        if end < 0:
+            break
+        fields.setdefault(name, text[i + 1:end])
+        i = end + 1
+        while i < len(text) and not text[i].isspace():
+            i += 1  # cpe's trailing "a", unknown flags
+    return fields
+
+def expand_template(template, match):
+    def variable(m):
+        group = int(m.group(1) or m.group(2) or m.group(5))
+        try:
+            value = (match.group(group) or b'').decode('latin-1')
+        except IndexError:
+            return ''
+        if m.group(1):
+            return ''.join(c if c.isprintable() else '' for c in value)
+        if m.group(2):
+            return value.replace(m.group(3), m.group(4))
+        return value
+    return TEMPLATE_VARIABLE.sub(variable, template).strip()
+
+class Match:
+    def __init__(self, service, pattern, info, soft=False):
+        self.service = service
+        self.pattern = pattern
+        self.info = info
+        self.soft = soft
+
+    # Version string in nmap's "product version (info)" form
+    def version(self, match):
+        product = expand_template(self.info.get('p', ''), match)
+        version = expand_template(self.info.get('v', ''), match)
+        info = expand_template(self.info.get('i', ''), match)
+        text = ' '.join(part for part in (product, version) if part)
+        if info:
+            text = f"{text} ({info})" if text else info
+        return text or None
+
+# "match ssh m|^SSH-...|s p/OpenSSH/ ..." (or softmatch); None if the line
+# can't be parsed or its regex doesn't compile under Python's re
+def parse_match(line):
+    directive, service, rest = line.split(None, 2)
+    if not rest.startswith('m') or len(rest) < 2:
+        return None
+    delimiter = rest[1]
+    end = rest.find(delimiter, 2)
+    if end < 0:
+        return None
+    pattern = rest[2:end]
+    flags = 0
+    i = end + 1
+    while i < len(rest) and rest[i] in 'is':
+        flags |= re.I if rest[i] == 'i' else re.S
+        i += 1
+    try:
+        regex = re.compile(pattern.encode('latin-1'), flags)
+    except (re.error, UnicodeEncodeError):
+        return None
+    return Match(service, regex, parse_version_info(rest[i:]), directive == 'softmatch')
+
+class Probe:
+    def __init__(self, protocol, name, payload):
+        self.protocol = protocol
+        self.name = name
+        self.payload = payload
+        self.rarity = 1
+        self.ports = set()
+        self.sslports = set()
+        self.fallback = []
+        self.matches = []
+
+def parse_probes(file_path):
+    probes = []
+    probe = None
+    with open(file_path, encoding='latin-1') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            directive, _, value = line.partition(' ')
+            if directive == 'Probe':
+                protocol, name, payload = value.split(None, 2)
+                # q|payload| with any delimiter after the q
+                payload = payload[2:payload.rfind(payload[1])]
+                probe = Probe(protocol, name, unescape(payload))
+                probes.append(probe)
+            elif probe is None:
+                continue
+            elif directive in ('match', 'softmatch'):
+                match = parse_match(line)
+                if match is not None:
+                    probe.matches.append(match)
+            elif directive == 'ports':
+                probe.ports = parse_port_list(value)
+            elif directive == 'sslports':
+                probe.sslports = parse_port_list(value)
+            elif directive == 'rarity':
+                probe.rarity = int(value)
+            elif directive == 'fallback':
+                probe.fallback = value.replace(',', ' ').split()
+    return probes
+
+class ProbeRegistry:
+    def __init__(self, probes, protocol='TCP'):
+        self.probes = [probe for probe in probes if probe.protocol == protocol]
+        self.by_name = {probe.name: probe for probe in self.probes}
+        self.null = self.by_name.get('NULL')
+        self.payload_probes = [probe for probe in self.probes if probe.payload]
+        self.ssl_ports = set()
+        for probe in self.probes:
+            self.ssl_ports |= probe.sslports
+        self.cache = {}
+        self.port_probes = {}
+
+    def hinted(self, probe, port, tls):
+        return port in (probe.sslports if tls else probe.ports)
+
+    # Whether to wait for a banner before sending anything
+    def wait_for_banner(self, port, tls):
+        if self.null is not None and self.hinted(self.null, port, tls):
+            return True
+        return not any(self.hinted(probe, port, tls) for probe in self.payload_probes)
+
+    # Payload probes to try on `port`: those hinted for it first, then the
+    # rest up to `intensity`, each group by rarity
+    def candidates(self, port, tls, intensity=DEFAULT_INTENSITY):
+        hinted = [p for p in self.payload_probes if self.hinted(p, port, tls)]
+        others = [p for p in self.payload_probes
+                  if p.rarity <= intensity and not self.hinted(p, port, tls)]
+        return sorted(hinted, key=lambda p: p.rarity) + sorted(others, key=lambda p: p.rarity)
+
+    # The most common probe hinted for `port`, or None
+    def port_probe(self, port):
+        if port not in self.port_probes:
+            hinted = [probe for probe in self.probes if port in probe.ports]
+            self.port_probes[port] = min(hinted, key=lambda p: p.rarity) if hinted else None
+        return self.port_probes[port]
+
+    # (service, version) for `response` to `probe`, or (None, None)
+    def match(self, probe, response):
+        key = (probe.name, response)
+        found = self.cache.get(key)
+        if found is None:
+            found = self.find_match(probe, response)
+            if len(self.cache) >= CACHE_SIZE:
+                self.cache.clear()
+            self.cache[key] = found
+        return found
+
+    def find_match(self, probe, response):
+        rule_sets = [probe] + [self.by_name[name] for name in probe.fallback if name in self.by_name]
+        if self.null is not None and self.null is not probe:
+            rule_sets.append(self.null)
+        soft = None
+        for rules in rule_sets:
+            for rule in rules.matches:
+                if soft is not None and rule.soft:
+                    continue
+                match = rule.pattern.search(response)
+                if match is None:
+                    continue
+                if not rule.soft:
+                    return rule.service, rule.version(match)
+                soft = rule.service
+        return soft, None
+
+parsed = {}  # file path -> probes
+loaded = {}  # (file path, protocol) -> registry
+
+# Lazily loaded, process-wide registry of the `protocol` probes; an
+# unreadable probe file gives an empty registry, which only reads banners
+def get_registry(file_path=DEFAULT_PATH, protocol='TCP'):
+    registry = loaded.get((file_path, protocol))
+    if registry is None:
+        probes = parsed.get(file_path)
+        if probes is None:
+            try:
+                probes = parse_probes(file_path)
+            except OSError:
+                probes = []
+            parsed[file_path] = probes
+        registry = loaded[file_path, protocol] = ProbeRegistry(probes, protocol)
+    return registry
+
+def receive(s, timeout):
+    s.settimeout(timeout)
+    try:
+        return s.recv(READ_SIZE)
+    except socket.timeout:
+        return None
+
+def first_line(response):
+    line = response.decode(errors='replace').strip().split('\r\n')[0].split('\n')[0]
+    return line or None
+
+# Identify the service on connected socket `s`. Returns (service, version);
+# service is None when nothing matched and version then falls back to the
+# first line the port sent. With `tls_handshake_only` a TLS port is not
+# probed further and its version describes the handshake. Socket and TLS
+# errors propagate.
+def identify(s, ip, port, timeout=1, intensity=DEFAULT_INTENSITY, probe_file=DEFAULT_PATH,
+             tls_handshake_only=False):
+    registry = get_registry(probe_file)
+    if port not in registry.ssl_ports:
+        return run_probes(registry, s, port, False, timeout, intensity)
+    # wrap_socket detaches `s`, so the caller closing it closes nothing
+    with tls_info.handshake(s, ip, timeout) as ssock:
+        if tls_handshake_only:
+            return None, tls_info.describe(ssock)
+        try:
+            service, version = run_probes(registry, ssock, port, True, timeout, intensity)
+        finally:
+            tls_info.save_session(ssock, ip)
+    return tls_service(service, True), version
+
+# The banner wait and the probes share one read budget of `timeout` seconds,
+# so a silent port costs no more than that whatever is tried on it
+def run_probes(registry, s, port, tls, timeout, intensity):
+    service = None
+    deadline = time.monotonic() + timeout
+    if registry.wait_for_banner(port, tls):
+        hinted = registry.null is not None and registry.hinted(registry.null, port, tls)
+        banner = receive(s, timeout if hinted else timeout / 2)
+        if banner == b'':
+            return None, None
+        if banner:
+            service, version = registry.match(registry.null, banner) if registry.null else (None, None)
+            return service, version or first_line(banner)
+    for probe in registry.candidates(port, tls, intensity)[:MAX_PROBES]:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            break
+        s.sendall(probe.payload)
+        response = receive(s, min(left, timeout if registry.hinted(probe, port, tls) else timeout / 2))
+        if response == b'':
+            break
+        if response:
+            service, version = registry.match(probe, response)
+            return service, version or first_line(response)
+    return service, None
+
+# http over TLS is reported as https, anything else as ssl/<service>
+def tls_service(service, tls):
+    if not tls or service is None:
+        return service
+    return 'https' if service == 'http' else f"ssl/{service}"
+
+# Datagram the UDP engine sends to `port`: the payload of the port's UDP
+# probe, or an empty datagram
+def udp_payload(port, probe_file=DEFAULT_PATH):
+    probe = get_registry(probe_file, 'UDP').port_probe(port)
+    return probe.payload if probe is not None else b''
+
+# (service, version) of UDP `port` from its `reply` to udp_payload()
+def identify_udp(port, reply, probe_file=DEFAULT_PATH):
+    registry = get_registry(probe_file, 'UDP')
+    probe = registry.port_probe(port)
+    if probe is None:
+        return None, None
+    return registry.match(probe, reply)
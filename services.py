@@ -0,0 +1,160 @@
+import os
+import struct
+import sys
+from array import array
+
+# Compact index of the nmap-services file keyed by (port, proto).
+#
+# Each protocol gets two 65536-slot arrays: the index of the service name in a
+# shared name table (0 = no entry) and the open-frequency. The parsed index is
+# cached in a binary file next to the text file and rebuilt whenever the text
+# file's size or mtime change, so a normal startup only reads a few arrays
+# instead of re-parsing ~27k lines.
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nmap-services')
+PROTOCOLS = ('tcp', 'udp', 'sctp')
+PORT_COUNT = 65536
+
+MAGIC = b'NMSVIDX1' + (b'L' if sys.byteorder == 'little' else b'B')
+HEADER = struct.Struct('<9sqqII')  # magic, mtime_ns, size, name blob length, name count
+
+class ServiceIndex:
+    def __init__(self, names, name_ids, frequencies):
+        self.names = names
+        self.name_ids = name_ids
+        self.frequencies = frequencies
+        self.ranked = {}
+
+    def name(self, port, proto='tcp', default='unknown'):
+        if not 0 <= port < PORT_COUNT:
+            return default
+        name_id = self.name_ids[proto][port]
+        return self.names[name_id] if name_id else default
+
+    def frequency(self, port, proto='tcp'):
+        if not 0 <= port < PORT_COUNT:
+            return 0.0
+        return self.frequencies[proto][port]
+
+    # Ports listed for `proto`, most frequently open first
+    def top_ports(self, n=None, proto='tcp'):
+        ranked = self.ranked.get(proto)
+        if ranked is None:
+            name_ids = self.name_ids[proto]
+            ranked = [port for port in range(1, PORT_COUNT) if name_ids[port]]
+            ranked.sort(key=self.frequencies[proto].__getitem__, reverse=True)
+            self.ranked[proto] = ranked
+        return ranked if n is None else ranked[:n]
+
+    # `ports` reordered so the most frequently open come first; ties keep
+    # their original order
+    def by_frequency(self, ports, proto='tcp'):
+        frequencies = self.frequencies[proto]
+        return sorted(ports, key=lambda port: frequencies[port] if 0 <= port < PORT_COUNT else 0.0,
+                      reverse=True)
+
+    def __contains__(self, key):
+        port, proto = key
+        return 0 <= port < PORT_COUNT and self.name_ids[proto][port] != 0
+
+def empty_arrays():
+    name_ids = {proto: array('H', bytes(2 * PORT_COUNT)) for proto in PROTOCOLS}
+    frequencies = {proto: array('f', bytes(4 * PORT_COUNT)) for proto in PROTOCOLS}
+    return name_ids, frequencies
+
+# Function to parse nmap-services file
+def parse_nmap_services(file_path):
+    names = ['']
+    name_table = {}
+    name_ids, frequencies = empty_arrays()
+    with open(file_path, 'r') as file:
+        for line in file:
+            if line.startswith("#") or not line.strip():
+                continue
+            parts = line.split(None, 3)
+            port, _, proto = parts[1].partition('/')
+            if proto not in name_ids:
+                continue
+            port = int(port)
+            service_name = parts[0]
+            if service_name not in name_table:
+                name_table[service_name] = len(names)
+                names.append(service_name)
+            name_ids[proto][port] = name_table[service_name]
+            if len(parts) > 2:
+                frequencies[proto][port] = float(parts[2])
+    return ServiceIndex(names, name_ids, frequencies)
+
+def cache_path(file_path):
+    return file_path + '.idx'
+
+def write_cache(index, file_path, st):
+    blob = '\n'.join(index.names).encode()
+    tmp = f"{cache_path(file_path)}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, st.st_mtime_ns, st.st_size, len(blob), len(index.names)))
+            f.write(blob)
+            for proto in PROTOCOLS:
+                f.write(index.name_ids[proto].tobytes())
+                f.write(index.frequencies[proto].tobytes())
+        os.replace(tmp, cache_path(file_path))
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+def read_cache(file_path, st):
+    try:
+        with open(cache_path(file_path), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    magic, mtime_ns, size, blob_len, name_count = HEADER.unpack_from(data)
+    if (magic, mtime_ns, size) != (MAGIC, st.st_mtime_ns, st.st_size):
+        return None
+    offset = HEADER.size
+    names = data[offset:offset + blob_len].decode().split('\n')
+    offset += blob_len
+    if len(names) != name_count or len(data) != offset + len(PROTOCOLS) * 6 * PORT_COUNT:
+        return None
+    name_ids, frequencies = {}, {}
+    for proto in PROTOCOLS:
+        name_ids[proto] = array('H', data[offset:offset + 2 * PORT_COUNT])
+        offset += 2 * PORT_COUNT
+        frequencies[proto] = array('f', data[offset:offset + 4 * PORT_COUNT])
+        offset += 4 * PORT_COUNT
+    return ServiceIndex(names, name_ids, frequencies)
+
+# Load the index for `file_path`, from the cache when it is still valid
+def load_index(file_path=DEFAULT_PATH):
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return ServiceIndex([''], *empty_arrays())
+    index = read_cache(file_path, st)
+    if index is None:
+        index = parse_nmap_services(file_path)
+        write_cache(index, file_path, st)
+    return index
+
+loaded = {}
+
+# Lazily loaded, process-wide index
+def get_index(file_path=DEFAULT_PATH):
+    index = loaded.get(file_path)
+    if index is None:
+        index = loaded[file_path] = load_index(file_path)
+    return index
+
+def service_name(port, proto='tcp'):
+    return get_index().name(port, proto)
+
+def top_ports(n=None, proto='tcp'):
+    return get_index().top_ports(n, proto)
+
+def by_frequency(ports, proto='tcp'):
+    return get_index().by_frequency(ports, proto)
@@ -0,0 +1,82 @@
+import multiprocessing
+import os
+import queue
+
+# Multi-process scanning. The (host, port) space is split into one shard per
+# worker process and every worker runs a complete scan engine over its shard,
+# so socket setup, probing and banner decoding run on all cores instead of
+# behind one GIL. Workers send their results through a queue; the parent
+# merges them, drops duplicates (a target listed twice, overlapping CIDR
+# blocks) and yields them as they arrive.
+#
+# With at least as many hosts as workers each worker gets its own hosts and
+# keeps the per-host limits. With fewer hosts the ports are striped across
+# workers instead, so every worker hits every host and the per-host limits are
+# divided between them.
+
+QUEUE_SIZE = 1024
+
+def default_processes():
+    return os.cpu_count() or 1
+
+# Returns (hosts, ports, share) per worker, where `share` is the number of
+# workers that probe the same hosts
+def plan_shards(hosts, ports, processes):
+    if len(hosts) >= processes:
+        shards = [(hosts[k::processes], ports, 1) for k in range(processes)]
+    else:
+        shards = [(hosts, ports[k::processes], processes) for k in range(processes)]
+    return [shard for shard in shards if shard[0] and len(shard[1])]
+
+def run_worker(worker, hosts, ports, share, config, out):
+    try:
+        worker(hosts, ports, share, config, lambda ip, result: out.put((ip, result)))
+    except BaseException as e:
+        out.put(e)
+    finally:
+        out.put(None)
+
+# Runs `worker(hosts, ports, share, config, emit)` in one process per shard
+# and yields every (ip, result) it emits once. `key(ip, result)` identifies
+# duplicates; results keyed None are always passed on. An exception raised
+# in a worker is re-raised here. `started()`, if given, is called once the
+# workers are running, for work the parent does next to them.
+def scan_sharded(hosts, ports, worker, config, processes=None, key=None, started=None):
+    hosts = list(hosts)
+    key = key or (lambda ip, result: (ip, result))
+    context = multiprocessing.get_context()
+    out = context.Queue(QUEUE_SIZE)
+    workers = [context.Process(target=run_worker, args=(worker, h, p, share, config, out), daemon=True)
+               for h, p, share in plan_shards(hosts, ports, processes or default_processes())]
+    for process in workers:
+        process.start()
+    if started is not None:
+        started()
+    running = len(workers)
+    seen = set()
+    try:
+        while running:
+            try:
+                item = out.get(timeout=1)
+            except queue.Empty:
+                # a worker killed outside our control never sends its None
+                if not any(process.is_alive() for process in workers):
+                    break
+                continue
+            if item is None:
+                running -= 1
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                k = key(*item)
+                if k is None:
+                    yield item
+                elif k not in seen:
+                    seen.add(k)
+                    yield item
+    finally:
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+        for process in workers:
+            process.join()
@@ -0,0 +1,108 @@
+import sqlite3
+import time
+from collections import namedtuple
+from results import PortResult
+
+# Persistent result store for repeated scans of the same hosts (--db).
+#
+# Every port ever seen open has a row keyed by (host, port, proto) holding
+# its last known state, service and version, when it was first seen and when
+# its state last changed. A rescan asks for the ports worth checking first:
+# those open last time and those whose state changed recently. At the end of
+# a scan the new results are diffed against the stored ones and written back
+# in one transaction.
+
+RECENT = 7 * 24 * 3600  # seconds a state change stays "recent"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    finished REAL NOT NULL,
+    hosts INTEGER NOT NULL,
+    partial INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ports (
+    host TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    proto TEXT NOT NULL,
+    state TEXT NOT NULL,
+    service TEXT,
+    version TEXT,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    changed REAL NOT NULL,
+    PRIMARY KEY (host, port, proto)
+);
+"""
+
+# kind is 'opened', 'closed' or 'changed'; old and new are PortResults (old
+# is None for an opened port, new for a closed one)
+Change = namedtuple('Change', ['kind', 'ip', 'old', 'new'])
+
+class ResultStore:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.started = time.time()
+        self.found = {}  # ip -> {(port, proto): PortResult}
+
+    def close(self):
+        self.db.close()
+
+    def has_history(self, ip):
+        return self.db.execute("SELECT 1 FROM ports WHERE host = ? LIMIT 1", (ip,)).fetchone() is not None
+
+    # Ports of `ip` worth probing first: open at the last scan, then those
+    # whose state changed within `recent` seconds
+    def priority_ports(self, ip, proto='tcp', recent=RECENT):
+        rows = self.db.execute(
+            "SELECT port FROM ports WHERE host = ? AND proto = ? AND (state = 'open' OR changed >= ?)"
+            " ORDER BY state = 'open' DESC, port", (ip, proto, time.time() - recent))
+        return [port for port, in rows]
+
+    def previous(self, ip):
+        rows = self.db.execute(
+            "SELECT port, proto, state, service, version FROM ports WHERE host = ?", (ip,))
+        return {(row[0], row[1]): PortResult(*row) for row in rows}
+
+    def record(self, ip, result):
+        self.found.setdefault(ip, {})[(result.port, result.proto)] = result
+
+    # Diff the recorded results against the stored state and save them.
+    # `scanned` maps every scanned host to the (port, proto) keys found closed
+    # or filtered on it; a port open before is only reported closed if it is among them,
+    # so ports a partial scan never reached keep their state. Returns the
+    # Changes of hosts that had been scanned before.
+    def finish(self, scanned, partial=False):
+        now = time.time()
+        changes = []
+        with self.db:
+            for ip, ports in scanned.items():
+                before = self.previous(ip)
+                found = self.found.get(ip, {})
+                for key, new in found.items():
+                    old = before.get(key)
+                    if old is None or old.state != 'open':
+                        if before:
+                            changes.append(Change('opened', ip, old, new))
+                        self.db.execute(
+                            "INSERT OR REPLACE INTO ports VALUES (?, ?, ?, ?, ?, ?,"
+                            " COALESCE((SELECT first_seen FROM ports WHERE host = ? AND port = ? AND proto = ?), ?),"
+                            " ?, ?)", (ip, *new, ip, new.port, new.proto, now, now, now))
+                        continue
+                    if (old.service, old.version) != (new.service, new.version):
+                        changes.append(Change('changed', ip, old, new))
+                    self.db.execute(
+                        "UPDATE ports SET service = ?, version = ?, last_seen = ?"
+                        " WHERE host = ? AND port = ? AND proto = ?",
+                        (new.service, new.version, now, ip, new.port, new.proto))
+                for key, old in before.items():
+                    if old.state == 'open' and key not in found and key in ports:
+                        changes.append(Change('closed', ip, old, old._replace(state='closed')))
+                        self.db.execute(
+                            "UPDATE ports SET state = 'closed', changed = ?"
+                            " WHERE host = ? AND port = ? AND proto = ?", (now, ip, *key))
+            self.db.execute("INSERT INTO scans (started, finished, hosts, partial) VALUES (?, ?, ?, ?)",
+                            (self.started, now, len(scanned), int(partial)))
+        return changes
@@ -0,0 +1,70 @@
+import ipaddress
+import itertools
+import socket
+import sys
+
+# Target specifications, expanded lazily so a /16 never sits in memory:
+#   192.168.1.10          single address
+#   192.168.1.0/24        CIDR block (network and broadcast addresses skipped)
+#   192.168.1.1-50        nmap-style octet ranges and lists, e.g. 10.0.1,3.1-254
+#   2001:db8::1           IPv6 address, or block such as 2001:db8::/120
+#   example.com           hostname, resolved by the caller (see resolve)
+
+# Canonical text of IP address `text` (IPv4 or IPv6), or None if it isn't one
+def parse_ip(text):
+    try:
+        return str(ipaddress.ip_address(text))
+    except ValueError:
+        return None
+
+def address_family(ip):
+    return socket.AF_INET6 if ':' in ip else socket.AF_INET
+
+def parse_octet(part):
+    values = []
+    for item in part.split(','):
+        first, sep, last = item.partition('-')
+        first = int(first) if first else 0
+        last = (int(last) if last else 255) if sep else first
+        if not 0 <= first <= last <= 255:
+            raise ValueError(f"invalid octet range: {item}")
+        values.extend(range(first, last + 1))
+    return values
+
+# Expands lazily, but checks `spec` at once: an invalid one raises ValueError
+def expand_target(spec):
+    try:
+        if '/' in spec:
+            network = ipaddress.ip_network(spec, strict=False)
+            return (str(ip) for ip in network.hosts())
+        parts = spec.split('.')
+        if len(parts) == 4 and any('-' in part or ',' in part for part in parts):
+            octets = [parse_octet(part) for part in parts]
+            return ('.'.join(map(str, ip)) for ip in itertools.product(*octets))
+    except ValueError as e:
+        raise ValueError(f"invalid target {spec}: {e}") from None
+    return iter([spec])
+
+# Whitespace separated targets, '#' starts a comment; '-' reads stdin
+def read_target_file(path):
+    file = sys.stdin if path == '-' else open(path)
+    try:
+        for line in file:
+            for spec in line.split('#', 1)[0].split():
+                yield spec
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+# With `on_error`, an invalid spec is passed to on_error(spec, error) and
+# skipped instead of raising
+def iter_targets(specs=(), files=(), on_error=None):
+    for spec in itertools.chain(specs, *(read_target_file(path) for path in files)):
+        try:
+            addresses = expand_target(spec)
+        except ValueError as e:
+            if on_error is None:
+                raise
+            on_error(spec, e)
+            continue
+        yield from addresses
@@ -1,144 +1,847 @@
 import socket
-import re
-import ssl
 import sys
-import subprocess
 import time
+import argparse
+import functools
+import asyncio
+import itertools
+import threading
 import psutil
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-# Function to parse nmap-services file
-def parse_nmap_services(file_path):
-    services = {}
-    with open(file_path, 'r') as file:
-        for line in file:
-            if not line.startswith("#") and line.strip():
-                parts = line.split()
-                service_name = parts[0]
-                port_proto = parts[1]
-                port = int(port_proto.split('/')[0])
-                services[port] = service_name
-    return services
-
-nmap_services = parse_nmap_services('nmap-services')
+import concurrent.futures
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+import async_scan
+import checkpoint
+import discovery
+import epoll_scan
+import hooks
+import metrics
+import portstates
+import output
+import ratecontrol
+import resolve
+from results import PortResult
+import scanner
+import scheduler
+import service_probes
+import services
+import shard_scan
+import store
+import targets
+import timing
+import udp_scan
+
+DEFAULT_UDP_PORTS = 100  # most frequent UDP ports scanned by --udp
+RESOLVE_BATCH = 256  # target specs held back while their hostnames resolve
 
 def is_valid_ip(ip):
-    pattern = re.compile(r"^(?:[0-9]{1,3}\.){3}[0-9]{1,3}$")
-    return pattern.match(ip) is not None
+    return targets.parse_ip(ip) is not None
 
-def get_ip_from_user():
-    ip = sys.argv[1]
-    return ip
+# Parse a port list like "22,80,8000-8100" ("-" means every port)
+def parse_ports(spec):
+    if spec == "-":
+        return range(1, 65536)
+    ports = []
+    for part in spec.split(","):
+        first, sep, last = part.partition("-")
+        first = int(first) if first else 1
+        last = (int(last) if last else 65535) if sep else first
+        if not 0 < first <= last < 65536:
+            raise argparse.ArgumentTypeError(f"invalid port range: {part}")
+        ports.extend(range(first, last + 1))
+    return list(dict.fromkeys(ports))
 
-def scan_port(ip, port):
+# --hook SERVICE=COMMAND, with hooks' own message for a bad one
+def parse_hook(spec):
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(1)
-            result = s.connect_ex((ip, port))
-            if result == 0:
-                service_name = nmap_services.get(port, 'unknown')
-                version = None
-                if port == 80:
-                    version = get_http_version(ip, port)
-                elif port == 443:
-                    version = get_https_version(ip, port)
-                elif port == 554:
-                    version = get_rtsp_version(ip, port)
-                if version:
-                    return f"{port}/tcp   open  {service_name} {version}"
-                else:
-                    banner = get_banner(ip, port)
-                    if banner:
-                        return f"{port}/tcp   open  {service_name} {banner}"
-                    else:
-                        return f"{port}/tcp   open  {service_name}"
-    except:
-        return None
+        return hooks.parse_hook(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
-def get_banner(ip, port):
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(1)
-            s.connect((ip, port))
-            s.send(b'\n')
-            banner = s.recv(1024).decode().strip()
-            return banner
-    except:
-        return None
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="TCP connect and UDP port scanner")
+    parser.add_argument("targets", nargs="*", metavar="target",
+                        help="IPv4 or IPv6 address, CIDR block (10.0.0.0/24), octet range "
+                             "(10.0.0.1-50) or hostname")
+    parser.add_argument("-iL", "--input-file", action="append", default=[], metavar="FILE",
+                        help="read targets from FILE ('-' for stdin)")
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument("-p", "--ports", type=parse_ports, default=range(1, 10001),
+                           help='ports to scan, e.g. "22,80,8000-8100" or "-" for all (default: 1-10000)')
+    selection.add_argument("--top-ports", type=int, metavar="N",
+                           help="scan the N most frequently open ports from nmap-services")
+    parser.add_argument("-sU", "--udp", action="store_true",
+                        help="also scan UDP ports, alongside the TCP scan")
+    parser.add_argument("--udp-ports", type=parse_ports, metavar="PORTS",
+                        help=f"UDP ports to scan (default: the {DEFAULT_UDP_PORTS} most frequently "
+                             "open ones from nmap-services)")
+    parser.add_argument("--udp-retries", type=int, default=udp_scan.DEFAULT_RETRIES, metavar="N",
+                        help="retransmissions to a silent UDP port before it is taken as "
+                             f"open|filtered (default: {udp_scan.DEFAULT_RETRIES})")
+    parser.add_argument("--udp-max-rate", type=float, metavar="PPS",
+                        help="ceiling on UDP datagrams per second, retransmissions included "
+                             "(default: --max-rate)")
+    parser.add_argument("--order", choices=["numeric", "frequency"], default="numeric",
+                        help="probe order; frequency tries the most likely open ports first")
+    parser.add_argument("--version-intensity", type=int, choices=range(10), default=service_probes.DEFAULT_INTENSITY,
+                        metavar="0-9",
+                        help="try service probes up to this rarity on ports they are not meant for "
+                             f"(default: {service_probes.DEFAULT_INTENSITY})")
+    parser.add_argument("--probe-file", default=service_probes.DEFAULT_PATH, metavar="FILE",
+                        help="service probes in nmap-service-probes format (default: service-probes)")
+    parser.add_argument("--tls-info", action="store_true",
+                        help="identify TLS ports from the handshake alone: protocol, cipher and "
+                             "certificate summary")
+    parser.add_argument("--engine", choices=["async", "epoll", "thread"], default="async",
+                        help="scan engine (default: async)")
+    parser.add_argument("--concurrency", type=int, default=async_scan.default_concurrency(),
+                        help="connects kept in flight by the async and epoll engines")
+    parser.add_argument("--probe-concurrency", type=int, default=async_scan.DEFAULT_PROBE_CONCURRENCY,
+                        help="threads probing open ports in the async and epoll engines")
+    parser.add_argument("-T", "--timing", type=timing.get_template,
+                        default=timing.TEMPLATES[timing.DEFAULT_TEMPLATE],
+                        help="timing template, 0-5 or paranoid|sneaky|polite|normal|aggressive|insane "
+                             "(default: normal)")
+    parser.add_argument("--initial-rtt-timeout", type=float,
+                        help="connect timeout in seconds before the first RTT sample")
+    parser.add_argument("--min-rtt-timeout", type=float, help="lower bound of the adaptive connect timeout")
+    parser.add_argument("--max-rtt-timeout", type=float, help="upper bound of the adaptive connect timeout")
+    parser.add_argument("--timeout", type=float,
+                        help="fixed connect timeout in seconds, disables RTT adaptation")
+    parser.add_argument("--probe-timeout", type=float,
+                        help="fixed service probe read timeout in seconds")
+    parser.add_argument("--max-rate", type=float, metavar="PPS",
+                        help="global ceiling on connects per second")
+    parser.add_argument("--min-parallelism", type=int, default=ratecontrol.MIN_CWND,
+                        help="floor of the per-target congestion window "
+                             f"(default: {ratecontrol.MIN_CWND})")
+    parser.add_argument("--max-host-parallelism", type=int,
+                        help="ceiling of the per-target congestion window (default: --concurrency)")
+    parser.add_argument("--max-host-rate", type=float, metavar="PPS",
+                        help="per-target ceiling on connects per second")
+    parser.add_argument("--host-group", type=int, default=scheduler.DEFAULT_HOST_GROUP,
+                        help="hosts scanned in parallel by the async and epoll engines "
+                             f"(default: {scheduler.DEFAULT_HOST_GROUP})")
+    parser.add_argument("--processes", type=int, default=1, metavar="N",
+                        help="split the scan across N worker processes, 0 for one per core "
+                             "(default: 1)")
+    parser.add_argument("--max-scan-time", type=float, metavar="SECONDS",
+                        help="stop issuing probes after SECONDS and report the open ports found so far")
+    parser.add_argument("--grace-period", type=float, default=scheduler.DEFAULT_GRACE, metavar="SECONDS",
+                        help="time given to in-flight probes after --max-scan-time "
+                             f"(default: {scheduler.DEFAULT_GRACE:g})")
+    parser.add_argument("--checkpoint", dest="checkpoint_file", metavar="FILE",
+                        help="periodically save scan progress to FILE")
+    parser.add_argument("--checkpoint-interval", type=float, default=checkpoint.DEFAULT_INTERVAL,
+                        metavar="SECONDS",
+                        help=f"seconds between checkpoints (default: {checkpoint.DEFAULT_INTERVAL:g})")
+    parser.add_argument("--resume", metavar="FILE",
+                        help="continue the scan saved in checkpoint FILE; its targets and ports "
+                             "replace those given on the command line")
+    parser.add_argument("-oJ", "--output-json", metavar="FILE",
+                        help="stream findings to FILE as JSON Lines, one object per open port")
+    parser.add_argument("-oG", "--output-grepable", metavar="FILE",
+                        help="stream findings to FILE in nmap's grepable format")
+    parser.add_argument("-oX", "--output-xml", metavar="FILE",
+                        help="stream findings to FILE as nmap-style XML")
+    parser.add_argument("--hook", action="append", default=[], type=parse_hook,
+                        metavar="SERVICE=COMMAND",
+                        help="run shell COMMAND as soon as an open port whose service matches "
+                             "regex SERVICE is found; {ip}, {port}, {proto} and {service} are "
+                             "substituted")
+    parser.add_argument("--default-hooks", action="store_true",
+                        help="run the checks of portscan_py.sh (sshdowngrade.sh and sshattempt.sh "
+                             "on ssh, sslversion.sh on TLS ports) from the current directory")
+    parser.add_argument("--hook-parallelism", type=int, default=hooks.DEFAULT_PARALLELISM, metavar="N",
+                        help=f"follow-up checks run at once (default: {hooks.DEFAULT_PARALLELISM})")
+    parser.add_argument("--hook-timeout", type=float, default=hooks.DEFAULT_TIMEOUT, metavar="SECONDS",
+                        help=f"time limit of each check (default: {hooks.DEFAULT_TIMEOUT:g})")
+    parser.add_argument("--progress", action="store_true",
+                        help="print a stats line (rate, probes in flight, outcomes, latency, ETA) "
+                             "to stderr every --stats-every seconds")
+    parser.add_argument("--stats-every", type=float, default=metrics.DEFAULT_INTERVAL, metavar="SECONDS",
+                        help="interval of --progress and the stats files "
+                             f"(default: {metrics.DEFAULT_INTERVAL:g})")
+    parser.add_argument("--stats-json", metavar="FILE",
+                        help="append a JSON snapshot of the scan metrics to FILE every interval")
+    parser.add_argument("--stats-prometheus", metavar="FILE",
+                        help="keep the scan metrics in FILE in Prometheus text format, rewritten "
+                             "every interval (for node_exporter's textfile collector)")
+    parser.add_argument("--db", metavar="FILE",
+                        help="keep results in SQLite database FILE and report changes since the last scan")
+    parser.add_argument("--rescan", choices=["first", "only"],
+                        help="with --db, probe the ports open or recently changed on each known host "
+                             "first, or only those")
+    parser.add_argument("--filtered-limit", type=int, metavar="N",
+                        help="stop scanning a host once N probes have timed out without it "
+                             "answering any")
+    family = parser.add_mutually_exclusive_group()
+    family.add_argument("-4", dest="address_family", action="store_const", const=socket.AF_INET,
+                        default=socket.AF_UNSPEC, help="scan only the IPv4 addresses of hostnames")
+    family.add_argument("-6", dest="address_family", action="store_const", const=socket.AF_INET6,
+                        help="scan only the IPv6 addresses of hostnames")
+    parser.add_argument("--all-addresses", action="store_true",
+                        help="scan every address a hostname resolves to, not only the first of "
+                             "each family")
+    parser.add_argument("--dns-concurrency", type=int, default=resolve.DEFAULT_CONCURRENCY,
+                        help="hostname lookups run at once "
+                             f"(default: {resolve.DEFAULT_CONCURRENCY})")
+    parser.add_argument("-Pn", "--skip-discovery", action="store_true",
+                        help="treat every target as up instead of pinging it first")
+    parser.add_argument("--ping-ports", type=parse_ports,
+                        default=list(discovery.DEFAULT_PING_PORTS),
+                        help="ports used for TCP connect pings (default: "
+                             f"{','.join(map(str, discovery.DEFAULT_PING_PORTS))})")
+    parser.add_argument("--ping-timeout", type=float,
+                        help="host discovery timeout (default: the timing template's initial RTT timeout)")
+    args = parser.parse_args(argv)
+    if not args.targets and not args.input_file and not args.resume:
+        parser.error("no targets given")
+    check_targets(parser, args)
+    overrides = {name: getattr(args, name)
+                 for name in ("initial_rtt_timeout", "min_rtt_timeout", "max_rtt_timeout")
+                 if getattr(args, name) is not None}
+    args.timing = args.timing._replace(**overrides)
+    if args.max_rate is None:
+        args.max_rate = args.timing.max_rate
+    if args.timing.max_parallelism:
+        args.concurrency = min(args.concurrency, args.timing.max_parallelism)
+    if args.processes < 1:
+        args.processes = shard_scan.default_processes()
+    if args.top_ports is not None and args.top_ports < 1:
+        parser.error("--top-ports must be at least 1")
+    if args.udp_ports and not args.udp:
+        args.udp = True
+    if args.rescan and not args.db:
+        parser.error("--rescan needs --db")
+    if (args.checkpoint_file or args.resume) and args.processes > 1:
+        parser.error("--checkpoint and --resume need --processes 1")
+    if (args.progress or args.stats_json or args.stats_prometheus) and args.processes > 1:
+        parser.error("--progress and --stats-* need --processes 1")
+    if args.stats_every <= 0:
+        parser.error("--stats-every must be positive")
+    return args
+
+# Targets on the command line and in -iL files are checked before the scan
+# starts; those read from stdin can only be checked as they come
+def check_targets(parser, args):
+    for spec in args.targets:
+        try:
+            targets.expand_target(spec)
+        except ValueError as e:
+            parser.error(str(e))
+    for path in args.input_file:
+        if path == '-':
+            continue
+        try:
+            for spec in targets.read_target_file(path):
+                targets.expand_target(spec)
+        except OSError as e:
+            parser.error(f"cannot read target file {path}: {e.strerror}")
+        except ValueError as e:
+            parser.error(f"{path}: {e}")
+
+def skip_target(spec, error):
+    print(f"skipping {error}", file=sys.stderr)
 
-def get_http_version(ip, port):
+# Returns the port's portstates state and, for an open port, its probe result.
+# The connect and the probe are reported to `scan_metrics` if given.
+def scan_port(ip, port, host_timing=None, limiter=None, probe=None, scan_metrics=None):
+    host_timing = host_timing or timing.HostTiming()
+    probe = probe or scanner.probe_open_port
+    if limiter is not None:
+        limiter.wait()
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(1)
-            s.connect((ip, port))
-            s.send(b"HEAD / HTTP/1.1\r\nHost: {}\r\n\r\n".format(ip).encode())
-            response = s.recv(1024).decode()
-            version = response.split('\r\n')[0]
-            return version
-    except:
-        return None
+        with socket.socket(targets.address_family(ip), socket.SOCK_STREAM) as s:
+            s.settimeout(host_timing.connect_timeout())
+            result = measured_connect(s, (ip, port), host_timing, scan_metrics)
+            if result == 0:
+                return portstates.OPEN, metrics.measure(scan_metrics, 'probe', probe, s, ip, port,
+                                                        host_timing.read_timeout())
+            return portstates.connect_state(result), None
+    except OSError:
+        return portstates.FILTERED, None
 
-def get_https_version(ip, port):
+def measured_connect(s, address, host_timing, scan_metrics):
+    if scan_metrics is None:
+        return host_timing.timed_connect(s, address)
+    scan_metrics.started('connect')
+    st = time.monotonic()
+    outcome = 'error'
     try:
-        context = ssl.create_default_context()
-        with socket.create_connection((ip, port)) as sock:
-            with context.wrap_socket(sock, server_hostname=ip) as ssock:
-                ssock.settimeout(1)
-                ssock.send(b"HEAD / HTTP/1.1\r\nHost: {}\r\n\r\n".format(ip).encode())
-                response = ssock.recv(1024).decode()
-                version = response.split('\r\n')[0]
-                return version
-    except:
-        return None
+        result = host_timing.timed_connect(s, address)
+        outcome = metrics.connect_outcome(result)
+        return result
+    finally:
+        scan_metrics.finished('connect', time.monotonic() - st, outcome)
+
+def check_host_up(ip, ports=discovery.DEFAULT_PING_PORTS, timeout=1):
+    return bool(asyncio.run(discovery.discover_hosts([ip], ports, timeout)))
+
+# The service probe configured by `args`, as called by the engines
+def service_probe(args):
+    return functools.partial(scanner.probe_open_port, intensity=args.version_intensity,
+                             probe_file=args.probe_file, tls_handshake_only=args.tls_info)
+
+def host_timing(args):
+    return timing.HostTiming(args.timing, connect_timeout=args.timeout, read_timeout=args.probe_timeout)
+
+def congestion_window(args):
+    return ratecontrol.CongestionWindow(minimum=args.min_parallelism,
+                                        maximum=args.max_host_parallelism or args.concurrency)
+
+def rate_limiter(args):
+    return ratecontrol.RateLimiter(args.max_rate) if args.max_rate else None
+
+# Ports of `ip` to scan, in order: a rescan puts the host's known ports
+# first (or scans only those), and a resumed checkpoint skips those done
+def host_ports(ip, ports, args):
+    first = args.priority.get(ip)
+    if first is not None:
+        ports = first if args.rescan == "only" else prioritized(first, ports)
+    return args.checkpoint.remaining(ip, ports) if args.checkpoint else ports
+
+# The known ports of each of `hosts` in `priority` that are among `ports`,
+# so a shard only puts its own ports first
+def priority_within(priority, hosts, ports):
+    wanted = ports if isinstance(ports, range) else set(ports)
+    return {ip: [port for port in priority[ip] if port in wanted] for ip in hosts if ip in priority}
+
+def prioritized(first, ports):
+    yield from first
+    first = set(first)
+    for port in ports:
+        if port not in first:
+            yield port
+
+# Record the final state of a port, and keep the checkpoint, the metrics and
+# the host's progress up to date
+def port_done(args):
+    def completed(ip, port, state, result=None):
+        args.port_states.mark(ip, port, state)
+        if args.metrics:
+            args.metrics.completed()
+        if args.checkpoint:
+            args.checkpoint.record(ip, result)
+        if args.host_progress and state != portstates.OPEN:
+            args.host_progress.settled(ip)
+    return completed
 
-def get_rtsp_version(ip, port):
+def new_scheduler(hosts, ports, args):
+    progress = port_done(args)
+    def new_host(ip, ports):
+        limiter = ratecontrol.RateLimiter(args.max_host_rate) if args.max_host_rate else None
+        return scheduler.HostState(ip, host_ports(ip, ports, args), host_timing(args),
+                                   congestion_window(args), limiter, progress,
+                                   args.filtered_limit)
+    return scheduler.Scheduler(hosts, ports, new_host, args.host_group, args.deadline)
+
+def print_result(ip, result, hosts):
+    if len(hosts) > 1:
+        print(f"{ip}  {result}")
+    else:
+        print(result)
+
+async def run_async_scan(hosts, ports, args, emit):
+    async for ip, result in async_scan.scan_hosts(new_scheduler(hosts, ports, args), service_probe(args),
+                                                  concurrency=args.concurrency,
+                                                  probe_concurrency=args.probe_concurrency,
+                                                  limiter=rate_limiter(args), metrics=args.metrics):
+        emit(ip, result)
+
+def run_epoll_scan(hosts, ports, args, emit):
+    for ip, result in epoll_scan.scan_hosts(new_scheduler(hosts, ports, args), service_probe(args),
+                                            concurrency=args.concurrency,
+                                            probe_concurrency=args.probe_concurrency,
+                                            limiter=rate_limiter(args), metrics=args.metrics):
+        emit(ip, result)
+
+# Like executor.map over argument tuples, but keeps at most `window` calls
+# queued or running and yields results as they complete, so memory stays flat
+# however much work `iterable` describes. `timeout` is an optional callable
+# returning the seconds left to wait; the builtin TimeoutError is raised when
+# it runs out (concurrent.futures has its own one before Python 3.11).
+def bounded_map(executor, fn, iterable, window, timeout=None):
+    timeout = timeout or (lambda: None)
+    pending = set()
+    for args in iterable:
+        if len(pending) >= window:
+            done, pending = wait(pending, timeout(), return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError
+            for future in done:
+                yield future.result()
+        pending.add(executor.submit(fn, *args))
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(1)
-            s.connect((ip, port))
-            s.send(b"OPTIONS rtsp://{}:554 RTSP/1.0\r\nCSeq: 1\r\n\r\n".format(ip).encode())
-            response = s.recv(1024).decode()
-            version = response.split('\r\n')[0]
-            return version
-    except:
-        return None
-def check_host_up(ip):
+        for future in as_completed(pending, timeout()):
+            yield future.result()
+    except concurrent.futures.TimeoutError:
+        raise TimeoutError from None
+
+# Stops `work` once `deadline` expires, flagging the scan as partial
+def until_deadline(work, deadline):
+    for item in work:
+        if deadline.expired():
+            deadline.partial = True
+            return
+        yield item
+
+def run_thread_scan(hosts, ports, args, emit):
+    threads = psutil.cpu_count(logical=True)
+    limiter = rate_limiter(args)
+    probe = service_probe(args)
+    states = args.port_states
+    completed = port_done(args)
+
+    # A host that answered nothing within --filtered-limit probes is skipped
+    def looks_filtered(ip):
+        answered = states.count(ip, portstates.OPEN) + states.count(ip, portstates.CLOSED)
+        return answered == 0 and states.count(ip, portstates.FILTERED) >= args.filtered_limit
+
+    # Each host's timing lives as long as its probes, so `hosts` stays lazy
+    def host_work(ip):
+        timing = host_timing(args)
+        for port in host_ports(ip, ports, args):
+            if args.filtered_limit and looks_filtered(ip):
+                return
+            yield ip, port, timing, limiter, probe, args.metrics
+
+    work = (item for ip in hosts for item in host_work(ip))
+    deadline = args.deadline
+    timeout = None
+    if deadline is not None:
+        work = until_deadline(work, deadline)
+        timeout = deadline.abort_in
+    executor = ThreadPoolExecutor(max_workers=threads)
     try:
-        output = subprocess.check_output(['ping', '-c', '1', ip], stderr=subprocess.STDOUT)
-        return True
-    except subprocess.CalledProcessError:
-        return False
+        for ip, port, (state, result) in bounded_map(executor, scan_host_port, work, 4 * threads,
+                                                     timeout):
+            completed(ip, port, state, result)
+            if result:
+                emit(ip, result)
+    except TimeoutError:
+        deadline.partial = True
+    finally:
+        executor.shutdown(wait=deadline is None, cancel_futures=True)
+
+def scan_host_port(ip, port, host_timing, limiter, probe, scan_metrics):
+    return ip, port, scan_port(ip, port, host_timing, limiter, probe, scan_metrics)
+
+# Runs the selected engine over `hosts` and calls emit(ip, result) for every
+# open port
+def run_scan(hosts, ports, args, emit):
+    if args.engine == "async":
+        asyncio.run(run_async_scan(hosts, ports, args, emit))
+    elif args.engine == "epoll":
+        run_epoll_scan(hosts, ports, args, emit)
+    else:
+        run_thread_scan(hosts, ports, args, emit)
+
+# Scan of one shard in a worker process. Global limits are split evenly
+# between the workers, per-host limits between the `share` workers probing
+# the same hosts.
+def scan_shard(hosts, ports, share, args, emit):
+    processes = args.processes
+    args.concurrency = max(1, args.concurrency // processes)
+    if args.max_rate:
+        args.max_rate /= processes
+    if args.max_host_rate:
+        args.max_host_rate /= share
+    if args.max_host_parallelism:
+        args.max_host_parallelism = max(1, args.max_host_parallelism // share)
+    args.min_parallelism = max(1, args.min_parallelism // share)
+    args.priority = priority_within(args.priority, hosts, ports)
+    run_scan(hosts, ports, args, emit)
+    for ip in hosts:
+        emit(ip, portstates.HostStates(args.port_states.packed(ip)))
+
+# UDP scan of `ports`, run next to the TCP engine. Port states go to
+# args.udp_states and open ports to emit(ip, result).
+def run_udp_scan(hosts, ports, args, emit):
+    rate = args.udp_max_rate or args.max_rate
+    limiter = ratecontrol.RateLimiter(rate) if rate else None
+    payload = functools.partial(service_probes.udp_payload, probe_file=args.probe_file)
+
+    async def scan():
+        async for ip, port, state, reply in udp_scan.scan_hosts(
+                hosts, ports, payload, lambda: host_timing(args),
+                concurrency=min(args.concurrency, udp_scan.DEFAULT_CONCURRENCY),
+                retries=args.udp_retries, limiter=limiter, deadline=args.deadline,
+                metrics=args.metrics):
+            args.udp_states.mark(ip, port, state)
+            if args.metrics:
+                args.metrics.completed()
+            if state == portstates.OPEN:
+                emit(ip, scanner.udp_result(port, reply, args.probe_file))
+            elif args.host_progress:
+                args.host_progress.settled(ip)
+    asyncio.run(scan())
+
+# Runs fn(*args) in a thread of its own; the returned future gives its result
+# or re-raises its exception
+def in_thread(fn, *args):
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(fn, *args)
+    executor.shutdown(wait=False)
+    return future
+
+# Duplicate key of a sharded result; port states are never duplicates
+def result_key(ip, result):
+    return (ip, result.port) if isinstance(result, PortResult) else None
 
 def main():
-    ip = get_ip_from_user()
-    start_port = 1
-    end_port = 10000
-    
-    cores = 6
-    cores = psutil.cpu_count(logical=True)
-    print(f"number of cores in the cpu: {cores}")
-    threads = cores
-
-    if(check_host_up(ip)):
-        print("host is up : scanning.........")
+    args = parse_args()
+    args.checkpoint = None
+    if args.resume:
+        resume(args)
     else:
-        print("host is down :/")
-        return 
+        scan(args)
+
+def resume(args):
+    args.checkpoint = checkpoint.Checkpoint.load(args.resume, args.checkpoint_interval)
+    args.port_states = args.checkpoint.states
+    hosts, ports = args.checkpoint.hosts, args.checkpoint.ports
+    total = len(hosts) * len(ports)
+    print(f"Resuming from {args.resume}: {args.checkpoint.ports_done()} of {total} probes done")
+    run(hosts, ports, f"{len(ports)} ports", args)
+
+def scan(args):
+    if args.top_ports is not None:
+        ports = services.top_ports(args.top_ports, 'tcp')
+        description = f"top {len(ports)} ports"
+    else:
+        ports = args.ports
+        if args.order == "frequency":
+            ports = services.by_frequency(ports, 'tcp')
+        description = f"{len(ports)} ports"
+
+    hosts = resolve_targets(args)
+    # whether there is a single target, without expanding the rest
+    first = list(itertools.islice(hosts, 2))
+    hosts = itertools.chain(first, hosts)
+
+    if not args.skip_discovery:
+        ping_timeout = args.ping_timeout or args.timing.initial_rtt_timeout
+        on_down = None if len(first) == 1 else lambda ip: print(f"host {ip} is down :/")
+        hosts = asyncio.run(discovery.discover_hosts(hosts, args.ping_ports, ping_timeout,
+                                                     on_down=on_down))
+        if len(first) == 1:
+            print("host is up : scanning........." if hosts else "host is down :/")
+    # The addresses of the hosts to scan are kept, one list entry each, for the
+    # summaries, the checkpoint, the shards and the UDP scan; their port
+    # states are only held while a host is in progress. A host named twice (by
+    # name and address, or in two spellings) is scanned once.
+    hosts = list(dict.fromkeys(hosts))
+    if not hosts:
+        return
+    args.port_states = portstates.PortStates(ports)
+    if args.checkpoint_file:
+        args.checkpoint = checkpoint.Checkpoint(args.checkpoint_file, hosts, args.port_states,
+                                                args.checkpoint_interval)
+    run(hosts, ports, description, args)
+
+# Addresses of the targets in order, expanded lazily. Literal addresses and
+# blocks pass straight through; hostnames are resolved RESOLVE_BATCH specs at
+# a time, each to its first address of each family (or to all of them).
+def resolve_targets(args):
+    batch = []
+    for spec in targets.iter_targets(args.targets, args.input_file, skip_target):
+        if not batch and is_valid_ip(spec):
+            yield targets.parse_ip(spec)
+            continue
+        batch.append(spec)
+        if len(batch) >= RESOLVE_BATCH:
+            yield from resolve_batch(batch, args)
+            batch = []
+    yield from resolve_batch(batch, args)
+
+# Addresses of `specs`, resolving their hostnames in one batch
+def resolve_batch(specs, args):
+    names = [spec for spec in specs if not is_valid_ip(spec)]
+    resolved = {}
+    if names:
+        resolved = resolve.resolve_names(names, args.address_family, args.dns_concurrency)
+    for spec in specs:
+        ip = targets.parse_ip(spec)
+        if ip is not None:
+            yield ip
+            continue
+        addresses = resolved[spec]
+        if not addresses:
+            print(f"failed to resolve: {spec}")
+            continue
+        if not args.all_addresses:
+            addresses = resolve.one_per_family(addresses)
+        print(f"{spec} resolves to {', '.join(addresses)}")
+        yield from addresses
+
+# (port, proto) of the ports found closed or filtered on each host, for the
+# change report of --db. A silent UDP port may still be open, so only UDP
+# ports that were refused count.
+def not_open_ports(hosts, states, udp_states=None):
+    found = {}
+    for ip in hosts:
+        ports = states.ports_in(ip, portstates.CLOSED) + states.ports_in(ip, portstates.FILTERED)
+        found[ip] = {(port, 'tcp') for port in ports}
+        if udp_states is not None:
+            found[ip].update((port, 'udp') for port in udp_states.ports_in(ip, portstates.CLOSED))
+    return found
+
+# (proto, state, count, reason) of the closed and filtered `proto` ports of
+# `ip`, for the writers' <extraports>
+def extra_ports(ip, states, proto='tcp'):
+    names, reasons = ((portstates.UDP_NAMES, portstates.UDP_REASONS) if proto == 'udp'
+                      else (portstates.NAMES, portstates.REASONS))
+    counts = [(state, states.count(ip, state)) for state in (portstates.CLOSED, portstates.FILTERED)]
+    return [(proto, names[state], count, reasons[state]) for state, count in counts if count]
+
+def not_open_count(ip, states):
+    return states.count(ip, portstates.CLOSED) + states.count(ip, portstates.FILTERED)
+
+# Non-open states with more ports than this are summed up instead of listed
+SHOW_LIMIT = 25
+
+# nmap-style report of the `proto` ports of `ip` that were not printed as open
+def print_port_summary(ip, states, hosts, proto='tcp'):
+    prefix = f"{ip}  " if len(hosts) > 1 else ""
+    names, reasons = ((portstates.UDP_NAMES, portstates.UDP_REASONS) if proto == 'udp'
+                      else (portstates.NAMES, portstates.REASONS))
+    hidden = []
+    listed = states.count(ip, portstates.OPEN)
+    for state in (portstates.CLOSED, portstates.FILTERED):
+        count = states.count(ip, state)
+        name = names[state]
+        if count > SHOW_LIMIT:
+            hidden.append(f"{count} {name} {proto} ports ({reasons[state]})")
+            continue
+        for port in states.ports_in(ip, state):
+            print(f"{prefix}{PortResult(port, proto, name, services.service_name(port, proto), None)}")
+        listed += count
+    unknown = states.count(ip, portstates.UNKNOWN)
+    if not listed and hidden:
+        print(f"{prefix}All {len(states.ports) - unknown} scanned {proto} ports are in ignored states")
+    if hidden:
+        print(f"{prefix}Not shown: {', '.join(hidden)}")
+    if unknown:
+        print(f"{prefix}Not scanned: {unknown} {proto} ports")
+
+# Follow-up checks of --hook and --default-hooks, or None
+def new_hook_runner(args, lock):
+    specs = list(args.hook)
+    if args.default_hooks:
+        specs += hooks.DEFAULT_HOOKS
+    if not specs:
+        return None
+
+    def report(check):
+        with lock:
+            print(f"[check] {check.name} ({check.ip} {check.result.port}/{check.result.proto} "
+                  f"{check.result.service}): {check.status} in {check.duration:.1f}s")
+            for line in check.output.rstrip().splitlines():
+                print(f"    {line}")
+    return hooks.HookRunner([hooks.CommandHook(service, command, args.hook_timeout)
+                             for service, command in specs], args.hook_parallelism, report)
+
+# TCP probes the scan has left to do: the known ports of each host among
+# `ports` for --rescan only, less the ports a resumed checkpoint already settled
+def scan_size(hosts, ports, args):
+    priority = priority_within(args.priority, hosts, ports)
+    return sum(host_scan_size(ip, ports, priority, args) for ip in hosts)
+
+def host_scan_size(ip, ports, priority, args):
+    size = len(priority[ip]) if args.rescan == "only" and ip in priority else len(ports)
+    if args.checkpoint:
+        size -= len(args.checkpoint.ports) - args.checkpoint.states.count(ip, portstates.UNKNOWN)
+    return size
+
+# Counts down the ports each host has left to settle and calls done(ip) once
+# it has none. Closed and filtered ports count as the engines settle them,
+# open ones once reported, so every finding of the host is out by then.
+class HostProgress:
+    def __init__(self, left, done):
+        self.lock = threading.Lock()
+        self.left = left  # ip -> ports
+        self.done = done
+
+    def settled(self, ip, n=1):
+        with self.lock:
+            if ip not in self.left:
+                return
+            self.left[ip] -= n
+            if self.left[ip] > 0:
+                return
+            del self.left[ip]
+        self.done(ip)
+
+    # Hosts that never got there (the deadline, --filtered-limit) are done now
+    def finish(self):
+        with self.lock:
+            left = list(self.left)
+            self.left.clear()
+        for ip in left:
+            self.done(ip)
+
+def print_changes(changes):
+    if not changes:
+        print("No changes since the last scan")
+        return
+    print("Changes since the last scan:")
+    for change in changes:
+        line = f"{change.ip}  {change.kind:<8} {change.new}"
+        if change.kind == "changed":
+            old = change.old
+            line += f" (was: {old.service} {old.version})" if old.version else f" (was: {old.service})"
+        print(line)
+
+def run(hosts, ports, description, args):
+    results = store.ResultStore(args.db) if args.db else None
+    args.priority = {}
+    if args.rescan:
+        known = {ip: results.priority_ports(ip) for ip in hosts if results.has_history(ip)}
+        args.priority = priority_within(known, hosts, ports)
+
+    outputs = output.open_outputs([("json", args.output_json), ("grepable", args.output_grepable),
+                                   ("xml", args.output_xml)], " ".join(sys.argv),
+                                  ('tcp', 'udp') if args.udp else ('tcp',))
+    try:
+        run_with_outputs(hosts, ports, description, args, results, outputs)
+    except BaseException:
+        for writer in outputs:
+            writer.close()
+        raise
+
+def run_with_outputs(hosts, ports, description, args, results, outputs):
+    known = results is not None and any(results.has_history(ip) for ip in hosts)
+    lock = threading.Lock()
+    checks = new_hook_runner(args, lock)
+    progress = None
+
+    # Called from the TCP engine and the UDP scan thread
+    def report(ip, result):
+        with lock:
+            print_result(ip, result, hosts)
+            if results is not None:
+                results.record(ip, result)
+        for writer in outputs:
+            writer.emit(ip, result)
+        if checks is not None:
+            checks.submit(ip, result)
+        if progress is not None:
+            progress.settled(ip)
+
+    if args.checkpoint:
+        for ip in hosts:
+            for result in args.checkpoint.results.get(ip, []):
+                report(ip, result)
 
     st = time.time()
-    print(f"Scanning {ip} from port {start_port} to {end_port}...")
+    deadline = None
+    if args.max_scan_time is not None:
+        deadline = scheduler.Deadline(args.max_scan_time, args.grace_period)
+    args.deadline = deadline
+    udp = None
+    if args.udp:
+        udp_ports = args.udp_ports or services.top_ports(DEFAULT_UDP_PORTS, 'udp')
+        args.udp_states = portstates.PortStates(udp_ports)
+        description += f", {len(udp_ports)} udp ports"
 
-    with ThreadPoolExecutor(max_workers=threads) as executor:  # Use a thread pool with 12 workers
-        futures = [executor.submit(scan_port, ip, port) for port in range(start_port, end_port + 1)]
-        for future in as_completed(futures):
-            result = future.result()
-            if result:
-                print(result)
-    
+    args.metrics = None
+    reporter = None
+    if args.progress or args.stats_json or args.stats_prometheus:
+        total = scan_size(hosts, ports, args) + (len(hosts) * len(udp_ports) if args.udp else 0)
+        args.metrics = metrics.ScanMetrics(total)
+        reporter = metrics.Reporter(args.metrics, args.stats_every, sys.stderr if args.progress else None,
+                                    args.stats_json, args.stats_prometheus)
+
+    if len(hosts) == 1:
+        print(f"Scanning {hosts[0]} ({description})...")
+    else:
+        print(f"Scanning {len(hosts)} hosts ({description} each)...")
+
+    if args.engine == "thread":
+        print(f"number of cores in the cpu: {psutil.cpu_count(logical=True)}")
+
+    # Once all of a host's ports are settled its summary is printed, the
+    # writers close its XML element and, unless --db or the checkpoint still
+    # needs them, its port states are dropped, so only the hosts in progress
+    # hold any. Ports of a resumed checkpoint are not counted, so a host it
+    # finished is done at once.
+    keep_states = results is not None or args.checkpoint is not None
+
+    def host_done(ip):
+        with lock:
+            print_port_summary(ip, args.port_states, hosts)
+            if args.udp:
+                print_port_summary(ip, args.udp_states, hosts, 'udp')
+        extraports = extra_ports(ip, args.port_states)
+        if args.udp:
+            extraports += extra_ports(ip, args.udp_states, 'udp')
+        for writer in outputs:
+            writer.host_done(ip, extraports)
+        if not keep_states:
+            args.port_states.forget(ip)
+            if args.udp:
+                args.udp_states.forget(ip)
+    priority = priority_within(args.priority, hosts, ports)
+    progress = HostProgress({ip: host_scan_size(ip, ports, priority, args)
+                             + (len(udp_ports) if args.udp else 0) for ip in hosts}, host_done)
+    for ip in hosts:
+        progress.settled(ip, 0)
+    args.host_progress = None
+
+    # The UDP scan runs in a thread next to the TCP engine. Called once any
+    # worker processes are running, as the host progress stays in this one.
+    def start_udp():
+        nonlocal udp
+        args.host_progress = progress
+        if args.udp:
+            udp = in_thread(run_udp_scan, hosts, udp_ports, args, report)
+    try:
+        if args.processes > 1:
+            for ip, result in shard_scan.scan_sharded(hosts, ports, scan_shard, args, args.processes,
+                                                      key=result_key, started=start_udp):
+                if isinstance(result, portstates.HostStates):
+                    before = not_open_count(ip, args.port_states)
+                    args.port_states.merge(ip, result.packed)
+                    progress.settled(ip, not_open_count(ip, args.port_states) - before)
+                else:
+                    report(ip, result)
+        else:
+            remaining = hosts
+            if args.checkpoint:
+                remaining = [ip for ip in hosts if not args.checkpoint.host_done(ip)]
+            start_udp()
+            try:
+                run_scan(remaining, ports, args, report)
+            finally:
+                if args.checkpoint:
+                    args.checkpoint.save()
+        if udp is not None:
+            udp.result()
+    finally:
+        if reporter is not None:
+            reporter.close()
+
+    progress.finish()
+    # Worker processes flag their own copy of the deadline, so a sharded scan
+    # that ran into it is taken as partial
+    partial = deadline is not None and (deadline.partial or args.processes > 1 and deadline.expired())
+    if partial:
+        print(f"Scan stopped at the {args.max_scan_time:g} second deadline: results are partial")
+    for writer in outputs:
+        writer.close(len(hosts), partial)
+    if checks is not None:
+        if checks.seen:
+            print(f"Waiting for follow-up checks ({len(checks.seen)} started)...")
+        checks.wait()
+    if results is not None:
+        scanned = not_open_ports(hosts, args.port_states, args.udp_states if args.udp else None)
+        changes = results.finish(scanned, partial)
+        results.close()
+        if known:
+            print_changes(changes)
     end = time.time()
     duration = end - st 
     print(f"Duration of scanning is {duration:.2f} seconds")
 
 if __name__ == "__main__":
     main()
-
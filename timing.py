@@ -0,0 +1,129 @@
+import asyncio
+import errno
+import socket
+import struct
+import time
+from collections import namedtuple
+
+# RTT-adaptive timeouts, modelled on nmap's timing engine.
+#
+# Every answered connect (SYN/ACK or RST) is an RTT sample. Each target keeps
+# a smoothed RTT and RTT variance (RFC 6298, the same estimator nmap uses) and
+# the connect timeout is srtt + 4 * rttvar, clamped to the template's bounds.
+# Until the first sample arrives the template's initial timeout is used.
+# Service probes wait for an application reply, so their read timeout is twice
+# the connect timeout, clamped to its own bounds.
+#
+# The slow templates also cap the send rate (probes/sec, nmap's scan delay)
+# and the number of connects in flight; None means no cap.
+
+TimingTemplate = namedtuple('TimingTemplate', [
+    'name', 'initial_rtt_timeout', 'min_rtt_timeout', 'max_rtt_timeout',
+    'min_read_timeout', 'max_read_timeout', 'max_rate', 'max_parallelism'])
+
+TEMPLATES = [
+    TimingTemplate('paranoid', 5.0, 0.1, 10.0, 1.0, 10.0, 1 / 300, 1),
+    TimingTemplate('sneaky', 5.0, 0.1, 10.0, 1.0, 10.0, 1 / 15, 1),
+    TimingTemplate('polite', 1.0, 0.1, 10.0, 0.5, 5.0, 2.5, None),
+    TimingTemplate('normal', 1.0, 0.1, 10.0, 0.5, 5.0, None, None),
+    TimingTemplate('aggressive', 0.5, 0.1, 1.25, 0.3, 2.0, None, None),
+    TimingTemplate('insane', 0.25, 0.05, 0.3, 0.2, 1.0, None, None),
+]
+DEFAULT_TEMPLATE = 3
+
+# connect_ex results that prove the target answered
+ANSWERED = (0, errno.ECONNREFUSED)
+
+# tcpi_rtt of Linux' struct tcp_info, in microseconds
+TCP_INFO_RTT = struct.Struct('=I')
+TCP_INFO_RTT_OFFSET = 68
+
+# asyncio.wait_for that never loses a cancellation. Before Python 3.12 a task
+# cancelled in the same loop iteration as `aw` completes gets the result
+# instead of the CancelledError and runs on after its scan was shut down. As
+# with wait_for, `aw` is cancelled and waited for if the wait ends first.
+async def wait_for(aw, timeout):
+    fut = asyncio.ensure_future(aw)
+    try:
+        done, _ = await asyncio.wait([fut], timeout=timeout)
+    finally:
+        if not fut.done():
+            fut.cancel()
+            await asyncio.wait([fut])
+    if not done:
+        raise asyncio.TimeoutError
+    return fut.result()
+
+# Accepts "0".."5" or a template name
+def get_template(value):
+    value = str(value).lower()
+    if value.isdigit() and int(value) < len(TEMPLATES):
+        return TEMPLATES[int(value)]
+    for template in TEMPLATES:
+        if template.name == value:
+            return template
+    raise ValueError(f"unknown timing template: {value}")
+
+# The handshake RTT the kernel measured on connected socket `s`, in seconds,
+# or None where TCP_INFO is not available
+def kernel_rtt(s):
+    if not hasattr(socket, 'TCP_INFO'):
+        return None
+    try:
+        info = s.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO_RTT_OFFSET + TCP_INFO_RTT.size)
+    except OSError:
+        return None
+    if len(info) < TCP_INFO_RTT_OFFSET + TCP_INFO_RTT.size:
+        return None
+    rtt, = TCP_INFO_RTT.unpack_from(info, TCP_INFO_RTT_OFFSET)
+    return rtt / 1e6 if rtt else None
+
+def clamp(value, low, high):
+    return min(max(value, low), high)
+
+class HostTiming:
+    # `connect_timeout` / `read_timeout` pin the respective timeout instead of
+    # deriving it from the RTT estimate.
+    def __init__(self, template=None, connect_timeout=None, read_timeout=None):
+        self.template = template or TEMPLATES[DEFAULT_TEMPLATE]
+        self.fixed_connect_timeout = connect_timeout
+        self.fixed_read_timeout = read_timeout
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+
+    def update(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            delta = rtt - self.srtt
+            self.srtt += delta / 8
+            self.rttvar += (abs(delta) - self.rttvar) / 4
+        self.samples += 1
+
+    def rtt_timeout(self):
+        t = self.template
+        if self.srtt is None:
+            return t.initial_rtt_timeout
+        return clamp(self.srtt + 4 * self.rttvar, t.min_rtt_timeout, t.max_rtt_timeout)
+
+    def connect_timeout(self):
+        if self.fixed_connect_timeout is not None:
+            return self.fixed_connect_timeout
+        return self.rtt_timeout()
+
+    def read_timeout(self):
+        if self.fixed_read_timeout is not None:
+            return self.fixed_read_timeout
+        t = self.template
+        return clamp(2 * self.rtt_timeout(), t.min_read_timeout, t.max_read_timeout)
+
+    # Time a blocking connect_ex and feed the RTT estimate when the target
+    # answered, whether with SYN/ACK (0) or RST (ECONNREFUSED)
+    def timed_connect(self, s, address):
+        st = time.monotonic()
+        result = s.connect_ex(address)
+        if result in ANSWERED:
+            self.update(time.monotonic() - st)
+        return result
@@ -0,0 +1,157 @@
+import datetime
+import hashlib
+import ipaddress
+import ssl
+
+# TLS for service detection.
+#
+# One client context is shared by every connection. It does no certificate or
+# hostname verification (a scan wants to see self-signed and internal
+# certificates, not reject them) and accepts legacy protocol versions and
+# ciphers where the local OpenSSL allows. The handshake runs under the
+# caller's timeout. The last session of each host is kept and offered to
+# the next handshake with it, so TLS ports served by the same stack resume
+# instead of paying for a full handshake. describe() summarises the
+# handshake alone: protocol, cipher and the certificate's subject, issuer,
+# names and expiry. The certificate is parsed once per fingerprint.
+
+CACHE_SIZE = 4096
+
+OID_COMMON_NAME = b'\x55\x04\x03'
+OID_SUBJECT_ALT_NAME = b'\x55\x1d\x11'
+
+context = None
+sessions = {}   # ip -> ssl.SSLSession
+summaries = {}  # certificate sha256 -> summary
+
+def get_context():
+    global context
+    if context is None:
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+        try:
+            ctx.minimum_version = ssl.TLSVersion.MINIMUM_SUPPORTED
+            ctx.set_ciphers('ALL:@SECLEVEL=0')
+        except (ValueError, ssl.SSLError):
+            pass
+        context = ctx
+    return context
+
+def remember(cache, key, value):
+    if len(cache) >= CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+
+# TLS handshake on connected socket `s`, bounded by `timeout`. Returns the
+# SSLSocket; SSL and socket errors propagate.
+def handshake(s, ip, timeout):
+    s.settimeout(timeout)
+    session = sessions.get(ip)
+    ssock = get_context().wrap_socket(s, server_hostname=ip, session=session,
+                                      do_handshake_on_connect=False)
+    try:
+        ssock.do_handshake()
+    except OSError:
+        ssock.close()
+        if session is not None:
+            sessions.pop(ip, None)
+        raise
+    save_session(ssock, ip)
+    return ssock
+
+# TLS 1.3 tickets arrive after the handshake, so this is worth calling again
+# once data has been read
+def save_session(ssock, ip):
+    session = ssock.session
+    if session is not None and (session.has_ticket or session.id):
+        remember(sessions, ip, session)
+
+# Children of the DER element spanning data[start:end], as (tag, start, end)
+def der_items(data, start=0, end=None):
+    end = len(data) if end is None else end
+    i = start
+    while i < end:
+        tag = data[i]
+        length = data[i + 1]
+        i += 2
+        if length & 0x80:
+            n = length & 0x7f
+            length = int.from_bytes(data[i:i + n], 'big')
+            i += n
+        yield tag, i, i + length
+        i += length
+
+def der_text(data, item):
+    return data[item[1]:item[2]].decode('utf-8', errors='replace')
+
+def common_name(data, name):
+    for _, start, end in der_items(data, name[1], name[2]):       # SET
+        for _, a_start, a_end in der_items(data, start, end):     # SEQUENCE
+            oid, value = list(der_items(data, a_start, a_end))[:2]
+            if data[oid[1]:oid[2]] == OID_COMMON_NAME:
+                return der_text(data, value)
+    return None
+
+def parse_time(data, item):
+    text = der_text(data, item)
+    fmt = '%y%m%d%H%M%SZ' if item[0] == 0x17 else '%Y%m%d%H%M%SZ'
+    return datetime.datetime.strptime(text, fmt).date()
+
+def alt_names(data, extensions):
+    names = []
+    sequence = next(der_items(data, extensions[1], extensions[2]))
+    for _, start, end in der_items(data, sequence[1], sequence[2]):
+        parts = list(der_items(data, start, end))
+        if data[parts[0][1]:parts[0][2]] != OID_SUBJECT_ALT_NAME:
+            continue
+        value = parts[-1]  # OCTET STRING wrapping the GeneralNames
+        general_names = next(der_items(data, value[1], value[2]))
+        for tag, n_start, n_end in der_items(data, general_names[1], general_names[2]):
+            if tag == 0x82:  # dNSName
+                names.append(data[n_start:n_end].decode('ascii', errors='replace'))
+            elif tag == 0x87 and n_end - n_start in (4, 16):  # iPAddress
+                names.append(str(ipaddress.ip_address(data[n_start:n_end])))
+    return names
+
+# "CN=host issuer=CA SAN=a,b expires 2026-01-31" from a DER certificate
+def certificate_summary(der):
+    certificate = next(der_items(der))
+    tbs = next(der_items(der, certificate[1], certificate[2]))
+    fields = list(der_items(der, tbs[1], tbs[2]))
+    if fields[0][0] == 0xa0:  # explicit version
+        fields = fields[1:]
+    issuer, validity, subject = fields[2], fields[3], fields[4]
+    parts = [f"CN={common_name(der, subject)}"]
+    if der[issuer[1]:issuer[2]] == der[subject[1]:subject[2]]:
+        parts.append("self-signed")
+    else:
+        parts.append(f"issuer={common_name(der, issuer)}")
+    extensions = [field for field in fields[5:] if field[0] == 0xa3]
+    names = alt_names(der, extensions[0]) if extensions else []
+    if names:
+        parts.append(f"SAN={','.join(names)}")
+    not_after = list(der_items(der, validity[1], validity[2]))[1]
+    parts.append(f"expires {parse_time(der, not_after)}")
+    return ' '.join(parts)
+
+def certificate_info(der):
+    fingerprint = hashlib.sha256(der).digest()
+    summary = summaries.get(fingerprint)
+    if summary is None:
+        try:
+            summary = certificate_summary(der)
+        except (IndexError, ValueError, StopIteration):
+            summary = f"sha256={fingerprint.hex()[:16]}"
+        remember(summaries, fingerprint, summary)
+    return summary
+
+# "TLSv1.3 TLS_AES_256_GCM_SHA384 CN=... [resumed]" for a completed handshake
+def describe(ssock):
+    parts = [ssock.version(), ssock.cipher()[0]]
+    der = ssock.getpeercert(binary_form=True)
+    if der:
+        parts.append(certificate_info(der))
+    if ssock.session_reused:
+        parts.append("resumed")
+    return ' '.join(part for part in parts if part)
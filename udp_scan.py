@@ -0,0 +1,115 @@
+import asyncio
+import socket
+import time
+from portstates import CLOSED, FILTERED, OPEN
+from targets import address_family
+from timing import HostTiming, wait_for
+
+# UDP scan engine.
+#
+# Every probe gets its own connected datagram socket, so the kernel reports
+# what the target sent back on it: a datagram means the port is open, an ICMP
+# port unreachable surfaces as ECONNREFUSED and means closed, and any other
+# ICMP error (host unreachable, administratively prohibited) means filtered.
+# Most UDP services ignore datagrams they cannot parse, so well-known ports
+# are sent a protocol payload (the UDP probes of the probe file); any other
+# port gets an empty datagram. A silent port is sent the probe again up to
+# `retries` times, since the request, the reply or the ICMP error may have
+# been dropped or rate limited on the way; a port that never answers is
+# open|filtered (portstates.FILTERED). Every datagram, retransmissions
+# included, takes a slot of the rate limiter. Each wait is the host's RTT
+# timeout, fed only by answers to first transmissions (Karn's algorithm).
+#
+# Work is ordered port by port across the hosts, so consecutive probes hit
+# different targets and their ICMP rate limits recover in between.
+
+DEFAULT_CONCURRENCY = 256  # probes in flight
+DEFAULT_RETRIES = 2
+READ_SIZE = 4096
+
+# Returns the port's portstates state and the reply of an open port. The
+# probe, retransmissions included, is reported to the optional
+# metrics.ScanMetrics `metrics` as one attempt.
+async def probe_port(loop, ip, port, payload, timing, retries=DEFAULT_RETRIES, limiter=None,
+                     metrics=None):
+    s = socket.socket(address_family(ip), socket.SOCK_DGRAM)
+    s.setblocking(False)
+    first = time.monotonic()
+    outcome = None
+    if metrics is not None:
+        metrics.started('udp')
+    try:
+        s.connect((ip, port))
+        for attempt in range(retries + 1):
+            if limiter is not None:
+                await limiter.acquire()
+            st = time.monotonic()
+            try:
+                await loop.sock_sendall(s, payload)
+                reply = await wait_for(loop.sock_recv(s, READ_SIZE), timing.connect_timeout())
+                state, outcome = OPEN, 'open'
+            except asyncio.TimeoutError:
+                continue
+            except ConnectionRefusedError:
+                state, reply, outcome = CLOSED, None, 'refused'
+            if attempt == 0:
+                timing.update(time.monotonic() - st)
+            return state, reply
+        outcome = 'timeout'
+        return FILTERED, None
+    except OSError:
+        outcome = 'error'
+        return FILTERED, None
+    finally:
+        s.close()
+        if metrics is not None:
+            metrics.finished('udp', time.monotonic() - first, outcome)
+
+# Probes `ports` on every host and yields (ip, port, state, reply) as ports
+# finish. `payload(port)` gives the datagram sent to a port and `new_timing()`
+# a timing.HostTiming for each host. With a scheduler.Deadline no probe starts
+# after it expires and probes in flight are abandoned past its grace period.
+# Probes are reported to the optional metrics.ScanMetrics `metrics`.
+async def scan_hosts(hosts, ports, payload, new_timing=HostTiming, concurrency=DEFAULT_CONCURRENCY,
+                     retries=DEFAULT_RETRIES, limiter=None, deadline=None, metrics=None):
+    loop = asyncio.get_running_loop()
+    timings = {ip: new_timing() for ip in hosts}
+    work = ((ip, port) for port in ports for ip in hosts)
+    results = asyncio.Queue()
+    done = object()
+
+    async def worker():
+        for ip, port in work:
+            if deadline is not None and deadline.expired():
+                deadline.partial = True
+                return
+            state, reply = await probe_port(loop, ip, port, payload(port), timings[ip], retries, limiter,
+                                            metrics)
+            await results.put((ip, port, state, reply))
+
+    async def run_workers():
+        try:
+            await asyncio.gather(*[worker() for _ in range(max(1, concurrency))])
+        except Exception as e:
+            await results.put(e)
+        await results.put(done)
+
+    task = asyncio.create_task(run_workers())
+    try:
+        while True:
+            if deadline is None:
+                result = await results.get()
+            else:
+                try:
+                    result = await wait_for(results.get(), deadline.abort_in())
+                except asyncio.TimeoutError:
+                    deadline.partial = True
+                    break
+            if result is done:
+                break
+            if isinstance(result, Exception):
+                raise result
+            yield result
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)